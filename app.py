@@ -1,104 +1,232 @@
-from flask import Flask, render_template, jsonify
-from apscheduler.schedulers.background import BackgroundScheduler
+from flask import Flask, render_template, jsonify, request, Response
 import monitor
 import atexit
 import datetime
+import json
+import math
 import threading
 import logger
+import history
+import payload
+import stream
+import ranking
+import metrics
+import shared
+import best
+import snapshot
+import time
 
 app = Flask(__name__)
 
-# Global storage for the latest data (thread-safe)
-data_lock = threading.Lock()
+# Latest snapshot. It is never mutated: each refresh builds a new dict and
+# swaps the reference, so readers never need a lock.
 latest_data = {
     'top_store': None,
     'last_updated': None,
-    'full_data': []
+    'updated_at': None,
+    # Compact counts of the ranked stores (snapshot.Snapshot)
+    'snapshot': None,
+    # Pre-serialized /api/status response (see payload.build)
+    'payload': None,
+    # Pre-sorted candidates for /api/best (see best.BestIndex)
+    'best': None
 }
 
+# Seconds between scheduled refreshes
+REFRESH_INTERVAL = 60
 
+# Seconds after which a snapshot is reported stale and a refresh is kicked off
+STALE_AFTER = 90
 
-# Region Definitions
-REGIONS = {
-    'Hokkaido': ['Sapporo', '札幌', 'SAPPORO'],
-    'Tohoku': ['Sendai', '仙台'],
-    'Kanto': ['Shibuya', 'Ebisu', 'Shinjuku', 'Ueno', 'Kashiwa', 'Machida', 'Yokohama', 'Omiya', 'Utsunomiya', 'Takasaki', '渋谷', '恵比寿', '新宿', '上野', '柏', '町田', '横浜', '大宮', '宇都宮', '高崎', 'OMIYA', 'SHINJUKU', 'NISHISHINJUKU'],
-    'Chubu': ['Nagoya', 'Shizuoka', 'Hamamatsu', 'Kanazawa', '名古屋', '静岡', '浜松', '金沢'],
-    'Kinki': ['Osaka', 'Umeda', 'Tenma', 'Shinsaibashi', 'Namba', 'Kyoto', 'Kobe', 'Chayamachi', '大阪', '梅田', '天満', '心斎橋', '難波', '京都', '神戸', '茶屋町', 'UMEDA', 'NAMBA', 'CHAYAMACHI'],
-    'Chugoku': ['Okayama', 'Hiroshima', '岡山', '広島', 'OKAYAMA', 'HIROSHIMA'],
-    'Shikoku': ['Matsuyama', '松山', 'MATSUYAMA'],
-    'Kyushu': ['Fukuoka', 'Kokura', 'Nagasaki', 'Oita', 'Kumamoto', 'Miyazaki', 'Kagoshima', 'Okinawa', '福岡', '小倉', '長崎', '大分', '熊本', '宮崎', '鹿児島', '沖縄', 'FUKUOKA', 'KUMAMOTO'],
-    'Korea': ['Seoul', 'Gangnam', 'Hongdae', 'ソウル', 'カンナム', 'ホンデ']
-}
+# Single-flight guard: at most one refresh runs at a time
+refresh_lock = threading.Lock()
+
+# Ranking maintained incrementally across refreshes (only touched by the refresh)
+ranking_index = ranking.RankingIndex()
+
+# Store IDs, names, sources and regions, shared by every snapshot of this process
+catalog = snapshot.Catalog()
 
-def detect_region(store_name):
-    """Detects the region based on the store name."""
-    for region, keywords in REGIONS.items():
-        for keyword in keywords:
-            if keyword in store_name:
-                return region
-    return 'Other'
 
 def update_job():
+    # Skip if a refresh (scheduled or triggered by a stale read) is already running
+    if not refresh_lock.acquire(blocking=False):
+        print("Refresh already in progress, skipping.")
+        metrics.refresh_skipped.inc()
+        return
+    try:
+        with metrics.refresh_seconds.time():
+            _refresh()
+    finally:
+        refresh_lock.release()
+
+def trigger_refresh():
+    """Starts a background refresh unless one is already running (leader only)."""
+    if shared.is_leader() and not refresh_lock.locked():
+        threading.Thread(target=update_job, daemon=True).start()
+
+def _refresh():
     global latest_data
     print(f"[{datetime.datetime.now()}] Updating data...")
     try:
-        data = monitor.get_all_data()
+        data, report = monitor.fetch_all()
+        failed = [f"{name}={r['status']}" for name, r in report.items() if r['status'] not in ('ok', 'cached')]
+        if failed:
+            print(f"Sources without data: {', '.join(failed)}")
         if data:
-            # Add region info
-            for store in data:
-                store['region'] = detect_region(store['name'])
+            now = datetime.datetime.now()
+            # Intern the poll into the catalog (regions are detected once per store);
+            # the ranking, /api/best index and history work from its columns
+            current = snapshot.Snapshot.from_rows(catalog, data, now.timestamp())
 
-            # Sort data by women count descending, then men count descending
-            sorted_data = sorted(data, key=lambda x: (x['women'], x['men']), reverse=True)
-            top_store = sorted_data[0] if sorted_data else None
+            # Ranking by women count descending, then men count descending.
+            # rank_change is how many places a store moved up (negative = down).
+            # These dicts only live until the payload is built.
+            moves = ranking_index.update(current)
+            sorted_data = [dict(current.row(store_id), rank_change=moves.get(store_id, 0))
+                           for store_id in ranking_index.ranking()]
+            top_id = ranking_index.top_store()
+            top_store = current.row(top_id) if top_id is not None else None
             
-            with data_lock:
-                latest_data['top_store'] = top_store
-                latest_data['full_data'] = sorted_data
-                # Store as JST (UTC+9)
-                jst_now = datetime.datetime.now() + datetime.timedelta(hours=9)
-                latest_data['last_updated'] = jst_now.strftime("%Y-%m-%d %H:%M:%S")
+            # Store as JST (UTC+9)
+            jst_now = now + datetime.timedelta(hours=9)
+            last_updated = jst_now.strftime("%Y-%m-%d %H:%M:%S")
+            # Serialize and compress the /api/status response once per refresh.
+            # The ETag follows the ranking only, so an unchanged poll still answers
+            # revalidations with a 304; its age is sent as X-Snapshot-Age.
+            status_payload = payload.build({
+                'timestamp': last_updated,
+                'updated_at': int(now.timestamp()),
+                'ranking': sorted_data,
+                'status': 'success'
+            }, version=sorted_data)
+            previous = latest_data
+            latest_data = {
+                'top_store': top_store,
+                'snapshot': current,
+                'last_updated': last_updated,
+                'updated_at': now.timestamp(),
+                'payload': status_payload,
+                'best': best.BestIndex(current, ranking_index)
+            }
             print(f"Data updated. Top store: {top_store['name'] if top_store else 'None'}")
+
+            # Push what changed to this worker's dashboards, and hand the
+            # snapshot and diff to the other workers
+            changed, removed = snapshot.diff(previous['snapshot'], current)
+            changed_names = {catalog.names[store_id] for store_id in changed}
+            diff = {
+                'changed': [store for store in sorted_data if store['name'] in changed_names],
+                'removed': [catalog.names[store_id] for store_id in removed],
+                'order': [store['name'] for store in sorted_data],
+                'timestamp': last_updated,
+                'updated_at': int(now.timestamp()),
+                'moves': {catalog.names[store_id]: move for store_id, move in moves.items()}
+            }
+            if stream.client_count():
+                stream.publish('diff', diff)
+            shared.publish({'last_updated': last_updated, 'updated_at': now.timestamp(), 'diff': diff}, status_payload)
+            publish_worker_state()
             
-            # --- Logging Optimization ---
-            # 1. Check for Zero Data (Prevention)
-            total_guests = sum(d.get('men', 0) + d.get('women', 0) for d in data)
-            
-            # 2. Check for Time (Business Hours: 17:00 - 07:00 JST)
-            # If it is between 07:00 and 16:59, we consider it "hours to skip"
-            # jst_now is already defined above
-            is_off_hours = 7 <= jst_now.hour < 17
-            
-            # 3. Check for Frequency (Every 10 minutes)
-            # To save spreadsheet space, we only log when the minute is 0, 10, 20, 30, 40, 50.
-            is_logging_time = jst_now.minute % 10 == 0
-
-            if total_guests == 0:
-                print(f"Skipping logging: Total guest count is 0.")
-            elif is_off_hours:
-                print(f"Skipping logging: Current time ({jst_now.strftime('%H:%M')}) is out of business hours (17:00-07:00).")
-            elif not is_logging_time:
-                print(f"Skipping logging: Interval optimization (Minute {jst_now.minute} is not divisible by 10).")
-            else:
-                # Log to Google Sheets (in background)
-                threading.Thread(target=logger.log_data, args=(data,)).start()
-                print("Logging data to Google Sheets...")
+            # Every poll goes to the local history store; Google Sheets is fed
+            # from it in bulk by export_job
+            history.record_snapshot(current)
         else:
             print("No data retrieved.")
     except Exception as e:
         print(f"Error during update: {e}")
 
-# Create scheduler
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=update_job, trigger="interval", minutes=1)
-scheduler.start()
+def export_job():
+    try:
+        exported = logger.export_history()
+        if exported:
+            print(f"Queued {exported} history rows for Google Sheets.")
+    except Exception as e:
+        print(f"Error during export: {e}")
 
-# Determine initial data immediately in a separate thread so startup isn't blocked
-threading.Thread(target=update_job).start()
+def scheduler_listener(event):
+    from apscheduler.events import EVENT_JOB_SUBMITTED
+    if event.code == EVENT_JOB_SUBMITTED:
+        lag = datetime.datetime.now(datetime.timezone.utc) - event.scheduled_run_times[-1]
+        metrics.scheduler_lag_seconds.observe(max(0.0, lag.total_seconds()), job=event.job_id)
+    else:
+        metrics.scheduler_missed.inc(job=event.job_id)
 
-# Shutdown scheduler on exit
-atexit.register(lambda: scheduler.shutdown())
+# Live stream connections, read when /metrics is scraped
+metrics.Gauge('lounge_stream_clients', 'Connected /api/stream clients', callback=stream.client_count)
+
+def load_shared_snapshot(meta, status_payload):
+    """Adopts a snapshot published by the leader and pushes its diff to this worker's clients."""
+    global latest_data
+    ranking_data = json.loads(status_payload['identity'])['ranking']
+    current = snapshot.Snapshot.from_rows(catalog, ranking_data, meta['updated_at'])
+    # Kept in step with the leader's so BestIndex can take its order from it
+    ranking_index.update(current)
+    top_id = ranking_index.top_store()
+    latest_data = {
+        'top_store': current.row(top_id) if top_id is not None else None,
+        'snapshot': current,
+        'last_updated': meta['last_updated'],
+        'updated_at': meta['updated_at'],
+        'payload': status_payload,
+        'best': best.BestIndex(current, ranking_index)
+    }
+    if stream.client_count() and meta.get('diff'):
+        stream.publish('diff', meta['diff'])
+
+# Created by start_leader; None in followers
+scheduler = None
+# Set once the leader's scheduler is running
+leader_started = threading.Event()
+
+def publish_worker_state():
+    """Shares this worker's metrics and, on the leader, the source health and cache state."""
+    shared.publish_metrics(metrics.dump())
+    if shared.is_leader():
+        shared.publish_state({'health': monitor.get_health(), 'cache': monitor.get_cache_stats()})
+
+def _leader_state(key, local):
+    # Scheduling, breaker and cache state only exist in the leader process
+    if shared.is_leader():
+        return local()
+    return shared.load_state().get(key, {})
+
+def start_leader():
+    """Runs the scraping side: only the leader process scrapes, records and exports."""
+    global scheduler
+    # The scheduler stack is imported here, off the import path of the web process
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+    scheduler = BackgroundScheduler()
+    scheduler.add_listener(scheduler_listener, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+    scheduler.add_job(func=update_job, trigger="interval", seconds=REFRESH_INTERVAL)
+    scheduler.add_job(func=export_job, trigger="interval", minutes=10)
+    scheduler.add_job(func=history.apply_retention, trigger="interval", hours=1)
+    scheduler.start()
+    # Determine initial data immediately in a separate thread so startup isn't blocked
+    trigger_refresh()
+    atexit.register(logger.stop)
+    atexit.register(lambda: scheduler.shutdown())
+    leader_started.set()
+
+# Serve the last snapshot (from a running leader, or persisted by the previous
+# run) until the first refresh completes; it is reported stale if it is old
+try:
+    boot_meta, boot_payload = shared.load_latest()
+    if boot_meta is not None:
+        load_shared_snapshot(boot_meta, boot_payload)
+except Exception as e:
+    print(f"Could not load the last snapshot: {e}")
+
+shared.start_publishing(publish_worker_state)
+
+# With several gunicorn workers one wins the leader lock and scrapes; the others
+# serve the snapshots it publishes and take over if it exits.
+# The scheduler starts in the background so importing the app stays fast.
+if shared.try_lead():
+    threading.Thread(target=start_leader, daemon=True).start()
+else:
+    shared.follow(load_shared_snapshot, start_leader)
 
 @app.route('/')
 def index():
@@ -106,57 +234,235 @@ def index():
 
 @app.route('/api/status')
 def get_status():
-    global latest_data
-    with data_lock:
-        # Check staleness (older than 90 seconds?)
-        is_stale = False
-        if latest_data['last_updated']:
-            last_time = datetime.datetime.strptime(latest_data['last_updated'], "%Y-%m-%d %H:%M:%S")
-            # Convert current server time to JST for comparison if last_updated is in JST
-            # Actually, standardizing on comparing objects is safer, but for now stick to manual offset
-            # This comparison logic checks relative time so timezone offset matters less as long as consistent
-            # BUT if we change storage to JST, we must compare against JST
-            current_jst = datetime.datetime.now() + datetime.timedelta(hours=9)
-            if (current_jst - last_time).total_seconds() > 90:
-                is_stale = True
-        
-        # If no data or stale, fetch synchronously
-        if not latest_data['full_data'] or is_stale:
-            print(f"Data missing or stale (Stale: {is_stale}), fetching synchronously...")
-            try:
-                data = monitor.get_all_data()
-                if data:
-                    # Add region info (FIX: ensure region is present even on sync fetch)
-                    for store in data:
-                        store['region'] = detect_region(store['name'])
-
-                    sorted_data = sorted(data, key=lambda x: (x['women'], x['men']), reverse=True)
-                    latest_data['top_store'] = sorted_data[0] if sorted_data else None
-                    latest_data['full_data'] = sorted_data
-                    # Store as JST
-                    jst_now = datetime.datetime.now() + datetime.timedelta(hours=9)
-                    latest_data['last_updated'] = jst_now.strftime("%Y-%m-%d %H:%M:%S")
-            except Exception as e:
-                print(f"Sync update failed: {e}")
+    start = time.perf_counter()
+    response = _status_response()
+    metrics.status_seconds.observe(time.perf_counter() - start)
+    if response.status_code == 304:
+        result = 'not_modified'
+    elif latest_data['payload'] is None:
+        result = 'no_snapshot'
+    else:
+        result = 'full'
+    metrics.status_responses.inc(result=result)
+    return response
+
+def _status_response():
+    # Serve whatever snapshot we have right now; never scrape on the request thread
+    current = latest_data
+    age = None
+    if current['updated_at']:
+        age = datetime.datetime.now().timestamp() - current['updated_at']
+    is_stale = age is None or age > STALE_AFTER
+
+    # Stale-while-revalidate: refresh in the background (single-flight)
+    if is_stale:
+        trigger_refresh()
 
+    status_payload = current['payload']
+    if status_payload is None:
         return jsonify({
-            'timestamp': latest_data['last_updated'],
-            'ranking': latest_data['full_data'],
-            'status': 'success' if latest_data['full_data'] else 'no_data'
+            'timestamp': None,
+            'ranking': [],
+            'status': 'pending' if refresh_lock.locked() or not shared.is_leader() else 'no_data'
         })
 
+    # Cacheable until the next scheduled refresh; revalidate with the ETag afterwards
+    # max-age already counts down with the snapshot's age, so the age goes in
+    # X-Snapshot-Age: a standard Age header would be subtracted a second time
+    max_age = 0 if is_stale else max(0, int(REFRESH_INTERVAL - age))
+    headers = {
+        'ETag': status_payload['etag'],
+        'Cache-Control': f'private, max-age={max_age}, must-revalidate',
+        'X-Snapshot-Age': str(int(age)),
+        'X-Snapshot-Stale': 'true' if is_stale else 'false',
+        'Vary': 'Accept-Encoding'
+    }
+    if payload.etag_matches(status_payload, request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+
+    encoding, body = payload.pick_encoding(status_payload, request.accept_encodings)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(body, mimetype='application/json', headers=headers)
+
+@app.route('/api/stream')
+def get_stream():
+    """Server-Sent Events: a 'snapshot' event on connect, then a 'diff' event per refresh."""
+    client = stream.subscribe()
+    if client is None:
+        return jsonify({"error": "Too many stream clients"}), 503
+
+    status_payload = latest_data['payload']
+    initial = None
+    if status_payload is not None:
+        initial = stream.format_event('snapshot', status_payload['identity'].decode('utf-8'))
+
+    return Response(
+        stream.events(client, initial),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/debug')
 def debug_status():
-    # Run full data fetch to see if parsing works
+    # Run full data fetch to see if parsing works (outside the refresh's scheduling state)
     try:
-        data = monitor.get_all_data()
+        data = monitor.fetch_every_source()
         return jsonify({
             "count": len(data),
             "data": data,
-            "connection_test": monitor.debug_connections()
+            "connection_test": monitor.debug_connections(),
+            "cache": _leader_state('cache', monitor.get_cache_stats),
+            "logger": logger.get_stats()
         })
     except Exception as e:
-        return jsonify({"error": str(e), "trace": "In get_all_data"})
+        return jsonify({"error": str(e), "trace": "In fetch_every_source"})
+
+@app.route('/metrics')
+def get_metrics():
+    # Prometheus text format, summed over every worker on this host (each publishes
+    # its counters every few seconds), so any worker can be scraped. Never contacts upstream sites.
+    return Response(metrics.render(shared.load_peer_metrics()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/sources')
+def sources_status():
+    # Breaker state, polling schedule and rolling stats per source, as last published
+    # by the leader (no upstream traffic)
+    return jsonify(_leader_state('health', monitor.get_health))
+
+@app.route('/api/cache')
+def cache_status():
+    # Conditional request / content hash counters from the leader (no upstream traffic)
+    return jsonify(_leader_state('cache', monitor.get_cache_stats))
+
+@app.route('/api/best')
+def get_best():
+    """
+    Top stores by a score (see best.py), from the index built at the last refresh.
+    ?formula=absolute|ratio|balanced, or ?count_weight=&ratio_weight= for a custom score
+    ?region=, ?source= and ?stores=name1,name2 (e.g. the stores near the user) filter
+    ?k= number of results (default 5)
+    """
+    current = latest_data
+    index = current['best']
+    if index is None:
+        return jsonify({'timestamp': None, 'results': [], 'status': 'pending'})
+
+    formula = request.args.get('formula', best.DEFAULT_FORMULA)
+    weights = None
+    try:
+        if 'count_weight' in request.args or 'ratio_weight' in request.args:
+            weights = (float(request.args.get('count_weight', 0)), float(request.args.get('ratio_weight', 0)))
+        k = int(request.args.get('k', best.DEFAULT_K))
+    except ValueError:
+        return jsonify({"error": "count_weight, ratio_weight and k must be numbers"}), 400
+    if weights is not None and not all(math.isfinite(weight) and weight >= 0 for weight in weights):
+        return jsonify({"error": "count_weight and ratio_weight must be finite and not negative"}), 400
+    if k < 1:
+        return jsonify({"error": "k must be at least 1"}), 400
+    if weights is None and formula not in best.FORMULAS:
+        return jsonify({"error": f"formula must be one of {', '.join(best.FORMULAS)}"}), 400
+    stores = [name.strip() for name in request.args.get('stores', '').split(',') if name.strip()]
+
+    results = index.query(
+        formula,
+        weights,
+        region=request.args.get('region') or None,
+        source=request.args.get('source') or None,
+        stores=stores or None,
+        k=k
+    )
+    return jsonify({
+        'timestamp': current['last_updated'],
+        'formula': formula if weights is None else 'custom',
+        'weights': list(weights or best.FORMULAS[formula]),
+        'results': results,
+        'status': 'success'
+    })
+
+def _parse_time(value, default):
+    """Accepts epoch seconds or 'YYYY-MM-DD HH:MM[:SS]' / 'YYYY-MM-DDTHH:MM[:SS]' in JST."""
+    if not value:
+        return default
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.datetime.fromisoformat(value.replace(' ', 'T'))
+    return int(parsed.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=9))).timestamp())
+
+def _jst_string(ts):
+    jst = datetime.datetime.fromtimestamp(ts, datetime.timezone(datetime.timedelta(hours=9)))
+    return jst.strftime("%Y-%m-%d %H:%M:%S")
+
+def _history_scope():
+    if request.args.get('store'):
+        return 'store', request.args['store']
+    if request.args.get('region'):
+        return 'region', request.args['region']
+    return None, None
+
+@app.route('/api/history')
+def get_history():
+    """
+    Occupancy history of one store (?store=) or region (?region=).
+    from/to: epoch seconds or JST datetime (default: last 24 hours)
+    bucket: raw | 10m | 1h (default 10m, raw is only available for stores)
+    """
+    scope, key = _history_scope()
+    if not scope:
+        return jsonify({"error": "store or region is required"}), 400
+    bucket = request.args.get('bucket', '10m')
+    try:
+        end = _parse_time(request.args.get('to'), int(datetime.datetime.now().timestamp()))
+        start = _parse_time(request.args.get('from'), end - 86400)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid time: {e}"}), 400
+
+    if bucket == 'raw' and scope == 'store':
+        # Points from before the raw retention window are 10 minute averages
+        points = [
+            {'ts': ts, 'time': _jst_string(ts), 'men': round(men, 2), 'women': round(women, 2), 'average': True}
+            if average else {'ts': ts, 'time': _jst_string(ts), 'men': men, 'women': women}
+            for ts, men, women, average in history.query(key, start, end)
+        ]
+    elif bucket in history.BUCKETS:
+        points = [
+            {'ts': ts, 'time': _jst_string(ts), 'men': round(men, 2), 'women': round(women, 2),
+             'men_max': men_max, 'women_max': women_max}
+            for ts, men, women, men_max, women_max in history.query_rollup(scope, key, start, end, bucket)
+        ]
+    else:
+        return jsonify({"error": f"Unsupported bucket: {bucket}"}), 400
+
+    return jsonify({scope: key, 'bucket': bucket, 'from': start, 'to': end, 'points': points})
+
+@app.route('/api/trends')
+def get_trends():
+    """
+    Day-of-week / hour averages (JST, Monday = 0).
+    ?store= or ?region=: the full weekly profile of that store or region
+    ?dow=&hour=: stores (or regions with scope=region) ranked by average women in that slot
+    """
+    scope, key = _history_scope()
+    if scope:
+        profile = [
+            {'dow': dow, 'hour': hour, 'men': round(men, 2), 'women': round(women, 2), 'samples': n}
+            for dow, hour, men, women, n in history.query_weekly(scope, key)
+        ]
+        peak = max(profile, key=lambda x: (x['women'], x['men'])) if profile else None
+        return jsonify({scope: key, 'profile': profile, 'peak': peak})
+
+    try:
+        dow = int(request.args['dow'])
+        hour = int(request.args['hour'])
+        limit = int(request.args.get('limit', 10))
+    except (KeyError, ValueError):
+        return jsonify({"error": "store, region or dow and hour are required"}), 400
+    scope = 'region' if request.args.get('scope') == 'region' else 'store'
+    rows = [
+        {'name': name, 'men': round(men, 2), 'women': round(women, 2), 'samples': n}
+        for name, men, women, n in history.query_slot(scope, dow, hour, limit)
+    ]
+    return jsonify({'dow': dow, 'hour': hour, 'scope': scope, 'ranking': rows})
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True, use_reloader=False)
@@ -0,0 +1,330 @@
+"""
+Offline benchmark suite.
+
+Replays the recorded responses in bench/fixtures through a local stub HTTP server
+(no network needed) and measures latency and throughput of each get_*_data call,
+get_all_data, update_job, /api/status and /api/best under concurrent load, plus the
+app's import time and time to first response in a fresh process. Results are
+compared against bench/baseline.json and the run fails when a benchmark is slower
+than the baseline by more than --tolerance.
+
+    python bench/run.py                    # run and compare against the baseline
+    python bench/run.py --update-baseline  # run and store the results as the new baseline
+    python bench/run.py --record           # refresh the fixtures from the live sites (needs network)
+    python bench/run.py --latency 50       # add 50 ms of simulated upstream latency
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baseline.json')
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# Recorded response per source: (file name, content type)
+FIXTURES = {
+    'oriental': ('oriental.html', 'text/html; charset=UTF-8'),
+    'jis': ('jis.html', 'text/html; charset=UTF-8'),
+    'xix': ('xix.json', 'application/json'),
+    'alfa': ('alfa.json', 'application/json'),
+    'yatakoi': ('yatakoi.json', 'application/json')
+}
+
+# Default allowed slowdown against the baseline (0.25 = 25% slower)
+TOLERANCE = 0.25
+# Benchmarks faster than this (seconds) are too noisy to flag
+MIN_REGRESSION = 0.0005
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves /<source> from the fixtures, with ETag / If-None-Match support."""
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment; a split write stalls on delayed ACKs
+    wbufsize = 65536
+    disable_nagle_algorithm = True
+    bodies = {}
+    latency = 0.0
+
+    def do_GET(self):
+        name = self.path.strip('/').split('?')[0]
+        if name not in self.bodies:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        body, content_type, etag = self.bodies[name]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(latency=0.0):
+    """Starts the stub server on a free local port. Returns (server, base_url)."""
+    bodies = {}
+    for name, (filename, content_type) in FIXTURES.items():
+        with open(os.path.join(FIXTURES_DIR, filename), 'rb') as f:
+            body = f.read()
+        bodies[name] = (body, content_type, '"' + hashlib.sha1(body).hexdigest()[:16] + '"')
+    StubHandler.bodies = bodies
+    StubHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def record_fixtures():
+    """Overwrites the fixtures with the current live responses."""
+    import monitor
+    import http_pool
+    for name, (filename, _) in FIXTURES.items():
+        source = monitor.SOURCES[name]
+        response = http_pool.get(source['url'], source['transport'], headers=source.get('headers'), timeout=20)
+        response.raise_for_status()
+        with open(os.path.join(FIXTURES_DIR, filename), 'wb') as f:
+            f.write(response.content)
+        print(f"recorded {name}: {len(response.content)} bytes")
+
+
+def measure(func, iterations, concurrency=1):
+    """Runs func iterations times over concurrency threads. Returns latency/throughput stats."""
+    latencies = []
+    lock = threading.Lock()
+
+    def call(_):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        for i in range(iterations):
+            call(i)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(call, range(iterations)))
+    wall = time.perf_counter() - start
+
+    return _stats(latencies, wall, concurrency)
+
+
+def _stats(latencies, wall, concurrency=1):
+    latencies = sorted(latencies)
+    return {
+        'p50': round(latencies[len(latencies) // 2], 6),
+        'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 6),
+        'ops': round(len(latencies) / wall, 1),
+        'n': len(latencies),
+        'concurrency': concurrency
+    }
+
+
+# Run in a fresh interpreter: times the app import and the first /api/status
+# response, served from the snapshot persisted by the benchmarks
+STARTUP_SCRIPT = '''
+import json, os, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+import monitor
+for name in monitor.SOURCES:
+    monitor.SOURCES[name]['url'] = sys.argv[2] + '/' + name
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/api/status')
+first = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first_response': first - start, 'status': response.status_code, 'bytes': len(response.data)}))
+sys.stdout.flush()
+os._exit(0)
+'''
+
+
+def measure_startup(base_url, runs):
+    """Cold-start timings over several fresh processes. Returns {name: stats}."""
+    timings = {'import': [], 'first_response': []}
+    for _ in range(runs):
+        # A fresh shared directory: no running leader, only the persisted snapshot
+        env = dict(os.environ, SHARED_DIR=tempfile.mkdtemp(prefix='lounge-bench-start-'))
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT, os.path.dirname(BENCH_DIR), base_url],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        assert result['status'] == 200 and result['bytes'] > 100, f"first response was not a snapshot: {result}"
+        for name in timings:
+            timings[name].append(result[name])
+    return {f"startup.{name}": _stats(values, sum(values)) for name, values in timings.items()}
+
+
+def run_benchmarks(base_url, scale):
+    """Runs every benchmark. Returns {name: stats}."""
+    import monitor
+    for name in FIXTURES:
+        monitor.SOURCES[name]['url'] = f"{base_url}/{name}"
+
+    # The app starts its scheduler and an initial refresh on import;
+    # pause the scheduler so only the benchmarks drive refreshes
+    import app
+    app.leader_started.wait(30)
+    app.scheduler.pause()
+    # Wait for the startup refresh to finish
+    app.refresh_lock.acquire()
+    app.refresh_lock.release()
+
+    def n(count):
+        return max(1, int(count * scale))
+
+    results = {}
+    getters = {
+        'oriental': monitor.get_oriental_data,
+        'jis': monitor.get_jis_data,
+        'xix': monitor.get_xix_data,
+        'alfa': monitor.get_alfa_data,
+        'yatakoi': monitor.get_yatakoi_data
+    }
+    for name, getter in getters.items():
+        assert getter(), f"{name} returned no stores from its fixture"
+
+        def cold(getter=getter, name=name):
+            # Forget validators and parsed rows so the body is downloaded and parsed
+            monitor._response_cache.pop(name, None)
+            getter()
+        results[f"get_{name}_data.cold"] = measure(cold, n(50))
+        results[f"get_{name}_data.warm"] = measure(getter, n(200))
+
+        with open(os.path.join(FIXTURES_DIR, FIXTURES[name][0]), 'rb') as f:
+            content = f.read()
+        results[f"parse.{name}.fast"] = measure(lambda: monitor.parse_payload(name, content, fast=True), n(200))
+        results[f"parse.{name}.soup"] = measure(lambda: monitor.parse_payload(name, content, fast=False), n(20))
+
+    def all_cold():
+        monitor._response_cache.clear()
+        monitor.fetch_all(force=True)
+    results['get_all_data.cold'] = measure(all_cold, n(30))
+    results['get_all_data.warm'] = measure(lambda: monitor.fetch_all(force=True), n(100))
+
+    def refresh():
+        # Make every source due again so update_job does a full poll
+        for state in monitor._poll_state.values():
+            state['next_poll'] = 0
+        app.update_job()
+    results['update_job'] = measure(refresh, n(50))
+    assert app.latest_data['payload'] is not None, "update_job produced no snapshot"
+
+    client = app.app.test_client()
+    etag = app.latest_data['payload']['etag']
+
+    def status(headers):
+        response = client.get('/api/status', headers=headers)
+        assert response.status_code in (200, 304), response.status_code
+    results['api_status.identity'] = measure(lambda: status({}), n(2000), concurrency=16)
+    results['api_status.gzip'] = measure(lambda: status({'Accept-Encoding': 'gzip'}), n(2000), concurrency=16)
+    results['api_status.not_modified'] = measure(lambda: status({'If-None-Match': etag}), n(2000), concurrency=16)
+
+    def best(query):
+        response = client.get('/api/best?' + query)
+        assert response.status_code == 200 and response.json['results'], query
+    results['api_best.preset'] = measure(lambda: best('formula=ratio&region=Kanto&k=5'), n(2000), concurrency=16)
+    results['api_best.custom'] = measure(lambda: best('count_weight=1&ratio_weight=2.5&source=oriental'), n(2000), concurrency=16)
+    results['api_best.stores'] = measure(lambda: best('formula=balanced&stores=JIS UMEDA,JIS NAMBA,YATAKOI UMEDA'), n(2000), concurrency=16)
+
+    results.update(measure_startup(base_url, n(10)))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints a comparison table. Returns the names of regressed benchmarks."""
+    regressions = []
+    print(f"{'benchmark':<30} {'p50 ms':>10} {'p95 ms':>10} {'ops/s':>10} {'base p50':>10} {'change':>8}")
+    for name, stats in results.items():
+        base = baseline.get(name)
+        change = ''
+        if base:
+            ratio = stats['p50'] / base['p50'] - 1 if base['p50'] else 0.0
+            change = f"{ratio:+.0%}"
+            if ratio > tolerance and stats['p50'] - base['p50'] > MIN_REGRESSION:
+                regressions.append(name)
+                change += ' !'
+        base_p50 = f"{base['p50'] * 1000:.3f}" if base else '-'
+        print(f"{name:<30} {stats['p50'] * 1000:>10.3f} {stats['p95'] * 1000:>10.3f} {stats['ops']:>10.1f} {base_p50:>10} {change:>8}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--record', action='store_true', help='re-record the fixtures from the live sites')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown, 0.25 = 25%%')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated upstream latency in ms')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier for iteration counts')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures()
+        return 0
+
+    # Keep the benchmark's history writes away from the real database
+    workdir = tempfile.mkdtemp(prefix='lounge-bench-')
+    os.environ['HISTORY_DB'] = os.path.join(workdir, 'history.db')
+    # ... and a leader lock of its own, so a running server does not make it a follower
+    os.environ['SHARED_DIR'] = workdir
+    os.environ['SNAPSHOT_PERSIST'] = os.path.join(workdir, 'snapshot.bin')
+
+    server, base_url = start_stub(args.latency / 1000)
+    try:
+        # The refresh path logs every poll to stdout; keep the report readable
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            results = run_benchmarks(base_url, args.scale)
+    finally:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.update_baseline:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 0
+    if regressions:
+        print(f"Regressions over {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import heapq
+import threading
+from collections import OrderedDict
+
+# "Best lounge" queries: stores scored by
+#     score = count_weight * women + ratio_weight * women / (men + RATIO_SMOOTHING)
+# An index is built once per refresh from the snapshot columns, with every named
+# formula pre-sorted (as store IDs) overall, per region, per source and per
+# region + source, so those queries are a slice. 'absolute' is the ranking's own
+# order and is taken from the RankingIndex instead of being sorted again.
+# Custom weights and store lists are scored on demand; every answer is cached
+# until the next refresh replaces the index.
+
+# name -> (count_weight, ratio_weight)
+FORMULAS = {
+    # Most women
+    'absolute': (1.0, 0.0),
+    # Most women per man
+    'ratio': (0.0, 1.0),
+    # Women count with a bonus for a good ratio
+    'balanced': (1.0, 4.0)
+}
+DEFAULT_FORMULA = 'absolute'
+# Added to men so empty lounges do not divide by zero or dominate the ratio
+RATIO_SMOOTHING = 1
+DEFAULT_K = 5
+MAX_K = 50
+# Answers cached per index (one refresh)
+CACHE_SIZE = 256
+
+
+def score(men, women, weights):
+    count_weight, ratio_weight = weights
+    return count_weight * women + ratio_weight * women / (men + RATIO_SMOOTHING)
+
+
+class BestIndex:
+    """Pre-sorted store IDs for one snapshot. Read-only after construction."""
+
+    def __init__(self, snapshot, ranking_index):
+        """ranking_index must already hold this snapshot (RankingIndex.update)."""
+        self._snapshot = snapshot
+        catalog = snapshot.catalog
+        ids = snapshot.ids()
+        # (formula, region, source) -> store IDs sorted by that formula; None = any
+        self._lists = {}
+        regions = set(catalog.regions[store_id] for store_id in ids)
+        for formula, weights in FORMULAS.items():
+            if formula == 'absolute':
+                # The ranking's own order (women, men, name); copied, as the index moves on
+                ordered = ranking_index.ranking()
+                for region in regions:
+                    self._lists[(formula, region, None)] = ranking_index.top(None, region)
+            else:
+                ordered = sorted(ids, key=lambda store_id: self._sort_key(store_id, weights))
+                for region in regions:
+                    self._lists[(formula, region, None)] = [store_id for store_id in ordered
+                                                            if catalog.regions[store_id] == region]
+            self._lists[(formula, None, None)] = ordered
+            for store_id in ordered:
+                region = catalog.regions[store_id]
+                source = catalog.sources[store_id]
+                for key in ((formula, None, source), (formula, region, source)):
+                    self._lists.setdefault(key, []).append(store_id)
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _score(self, store_id, weights):
+        return score(self._snapshot.men[store_id], self._snapshot.women[store_id], weights)
+
+    def _sort_key(self, store_id, weights):
+        # Highest score first; ties go to more women, more men, then the name
+        # (the dashboard's order, stable across refreshes)
+        snapshot = self._snapshot
+        return (-self._score(store_id, weights), -snapshot.women[store_id], -snapshot.men[store_id],
+                snapshot.catalog.names[store_id])
+
+    def query(self, formula=DEFAULT_FORMULA, weights=None, region=None, source=None, stores=None, k=DEFAULT_K):
+        """
+        Top k stores as dicts with a 'score' added. weights = (count_weight, ratio_weight)
+        overrides the named formula; stores limits the candidates to those names.
+        Raises KeyError for an unknown formula.
+        """
+        weights = tuple(weights) if weights is not None else FORMULAS[formula]
+        k = max(1, min(int(k), MAX_K))
+        stores = tuple(sorted(set(stores))) if stores else None
+        cache_key = (weights, region, source, stores, k)
+        with self._cache_lock:
+            result = self._cache.get(cache_key)
+            if result is not None:
+                self._cache.move_to_end(cache_key)
+                return result
+
+        named = next((name for name, preset in FORMULAS.items() if preset == weights), None)
+        snapshot = self._snapshot
+        catalog = snapshot.catalog
+        if stores is not None:
+            candidates = [catalog.ids[name] for name in stores if name in catalog.ids]
+            candidates = [store_id for store_id in candidates
+                          if store_id in snapshot
+                          and region in (None, catalog.regions[store_id])
+                          and source in (None, catalog.sources[store_id])]
+            top = heapq.nsmallest(k, candidates, key=lambda store_id: self._sort_key(store_id, weights))
+        elif named is not None:
+            top = self._lists.get((named, region, source), [])[:k]
+        else:
+            # Any pre-sorted list has the right members; only the order differs
+            candidates = self._lists.get((DEFAULT_FORMULA, region, source), [])
+            top = heapq.nsmallest(k, candidates, key=lambda store_id: self._sort_key(store_id, weights))
+
+        result = [dict(snapshot.row(store_id), score=round(self._score(store_id, weights), 3)) for store_id in top]
+        with self._cache_lock:
+            self._cache[cache_key] = result
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return result
@@ -0,0 +1,118 @@
+import re
+from html.parser import HTMLParser
+
+# Fast-path extractors that avoid building a full BeautifulSoup tree.
+# monitor.py keeps the BeautifulSoup parsers as the fallback when these find nothing.
+
+
+class _CardParser(HTMLParser):
+    """
+    Streaming tokenizer for pages made of repeated "cards".
+    item: (tag, classes) of the card element, e.g. ('a', {'card', 'wave-anime-wrap'})
+    fields: {field: selector} where selector is a tag name ('h4') or a class ('.num-male').
+    Only the first match of each field inside a card is kept, like select_one.
+    """
+
+    def __init__(self, item, fields):
+        super().__init__(convert_charrefs=True)
+        self.item_tag, self.item_classes = item
+        self.fields = fields
+        self.cards = []
+        self.card = None
+        self.card_depth = 0
+        # Field currently being captured: [field, tag, depth, text chunks]
+        self.capture = None
+
+    def _match(self, tag, classes):
+        for field, selector in self.fields.items():
+            if field in self.card:
+                continue
+            if selector.startswith('.'):
+                if selector[1:] in classes:
+                    return field
+            elif selector == tag:
+                return field
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        classes = ()
+        for key, value in attrs:
+            if key == 'class' and value:
+                classes = value.split()
+                break
+
+        if self.card is None:
+            if tag == self.item_tag and self.item_classes.issubset(classes):
+                self.card = {}
+                self.card_depth = 1
+            return
+
+        if tag == self.item_tag:
+            self.card_depth += 1
+        if self.capture is not None:
+            if tag == self.capture[1]:
+                self.capture[2] += 1
+            return
+        field = self._match(tag, classes)
+        if field:
+            self.capture = [field, tag, 1, []]
+
+    def handle_endtag(self, tag):
+        if self.card is None:
+            return
+        if self.capture is not None and tag == self.capture[1]:
+            self.capture[2] -= 1
+            if self.capture[2] == 0:
+                self.card[self.capture[0]] = ''.join(self.capture[3])
+                self.capture = None
+        if tag == self.item_tag:
+            self.card_depth -= 1
+            if self.card_depth == 0:
+                self._close_card()
+
+    def handle_data(self, data):
+        if self.capture is not None:
+            # Same as get_text(strip=True): strip each text node, then join
+            text = data.strip()
+            if text:
+                self.capture[3].append(text)
+
+    def _close_card(self):
+        if self.capture is not None:
+            self.card[self.capture[0]] = ''.join(self.capture[3])
+            self.capture = None
+        self.cards.append(self.card)
+        self.card = None
+
+
+def parse_simple_selector(selector):
+    """Splits a `tag.class1.class2` selector into ('tag', {'class1', 'class2'})."""
+    tag, _, classes = selector.partition('.')
+    return tag, set(classes.split('.')) if classes else set()
+
+
+def extract_cards(html, item, fields):
+    """
+    Returns a list of {field: text} dicts, one per card element in the html string.
+    Fields with no matching element inside a card are missing from its dict.
+    """
+    # Skip everything before the first card (head, inline CSS, scripts)
+    marker = html.find(max(item[1], key=len) if item[1] else '<' + item[0])
+    if marker == -1:
+        return []
+    start = html.rfind('<' + item[0], 0, marker)
+    parser = _CardParser(item, fields)
+    parser.feed(html[start if start != -1 else 0:])
+    parser.close()
+    return parser.cards
+
+
+def compile_assignment(variable):
+    """Precompiles the pattern for `var <variable> = {...};` embedded in a script."""
+    return re.compile(r'var ' + re.escape(variable) + r'\s*=\s*({.*?});', re.DOTALL)
+
+
+def extract_assignment(html, pattern):
+    """Returns the JSON text assigned by a compile_assignment pattern, or None."""
+    match = pattern.search(html)
+    return match.group(1) if match else None
@@ -0,0 +1,285 @@
+import sqlite3
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# Local time-series store for every poll of every store.
+# Raw samples are kept at full (1 minute) resolution for RAW_RETENTION_DAYS.
+# Each write also updates 10 minute, hourly and day-of-week/hour rollups per
+# store and per region, so trend queries never rescan raw samples.
+# 10 minute rollups are kept for DOWNSAMPLED_RETENTION_DAYS, the others forever.
+HISTORY_DB = os.environ.get('HISTORY_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.db'))
+RAW_RETENTION_DAYS = 30
+DOWNSAMPLED_RETENTION_DAYS = 365
+DOWNSAMPLE_BUCKET = 600
+
+# Rollup bucket sizes in seconds
+BUCKETS = {'10m': 600, '1h': 3600}
+JST_OFFSET = 9 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    store TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    men INTEGER NOT NULL,
+    women INTEGER NOT NULL,
+    source TEXT,
+    region TEXT,
+    PRIMARY KEY (store, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+
+-- scope is 'store' or 'region', key is the store name or region name.
+-- Region rollups aggregate the region totals of each poll.
+CREATE TABLE IF NOT EXISTS rollup_10m (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    men_sum INTEGER NOT NULL,
+    women_sum INTEGER NOT NULL,
+    men_max INTEGER NOT NULL,
+    women_max INTEGER NOT NULL,
+    PRIMARY KEY (scope, key, ts)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_1h (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    men_sum INTEGER NOT NULL,
+    women_sum INTEGER NOT NULL,
+    men_max INTEGER NOT NULL,
+    women_max INTEGER NOT NULL,
+    PRIMARY KEY (scope, key, ts)
+) WITHOUT ROWID;
+
+-- Day of week (0 = Monday) and hour in JST
+CREATE TABLE IF NOT EXISTS rollup_dow (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    dow INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    men_sum INTEGER NOT NULL,
+    women_sum INTEGER NOT NULL,
+    PRIMARY KEY (scope, key, dow, hour)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Idle connections kept for reuse. Shared by every thread and greenlet of the
+# process (under gevent a thread-local would be per request).
+POOL_SIZE = 4
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_setup_lock = threading.Lock()
+_setup_done = False
+
+
+def _open():
+    global _setup_done
+    conn = sqlite3.connect(HISTORY_DB, timeout=10, check_same_thread=False)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    if not _setup_done:
+        # WAL mode is stored in the database file; the schema only needs creating once
+        with _setup_lock:
+            if not _setup_done:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(SCHEMA)
+                _setup_done = True
+    return conn
+
+
+@contextmanager
+def connection():
+    """A pooled connection for the duration of the block, creating the database on first use."""
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _open()
+    try:
+        yield conn
+    finally:
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+_ROLLUP_UPSERT = """
+INSERT INTO {table} VALUES (?, ?, ?, 1, ?, ?, ?, ?)
+ON CONFLICT (scope, key, ts) DO UPDATE SET
+    n = n + 1,
+    men_sum = men_sum + excluded.men_sum,
+    women_sum = women_sum + excluded.women_sum,
+    men_max = MAX(men_max, excluded.men_max),
+    women_max = MAX(women_max, excluded.women_max)
+"""
+
+_DOW_UPSERT = """
+INSERT INTO rollup_dow VALUES (?, ?, ?, ?, 1, ?, ?)
+ON CONFLICT (scope, key, dow, hour) DO UPDATE SET
+    n = n + 1,
+    men_sum = men_sum + excluded.men_sum,
+    women_sum = women_sum + excluded.women_sum
+"""
+
+
+def jst_slot(ts):
+    """Returns (day of week with Monday = 0, hour) of a timestamp in JST."""
+    jst = ts + JST_OFFSET
+    # 1970-01-01 was a Thursday
+    return (jst // 86400 + 3) % 7, jst % 86400 // 3600
+
+
+def record(data, ts=None):
+    """
+    Writes one poll (all stores) and updates the rollups in a single transaction.
+    data: list of dicts [{'name': '...', 'men': 10, 'women': 10, 'source': '...', 'region': '...'}, ...]
+    """
+    ts = int(ts or time.time())
+    return _write([
+        (item['name'], ts, item.get('men', 0), item.get('women', 0), item.get('source'), item.get('region'))
+        for item in data
+    ], ts)
+
+
+def record_snapshot(snapshot, ts=None):
+    """
+    Like record(), straight from a snapshot.Snapshot's columns. Stale stores are
+    skipped, and so are the region totals of their regions (they would be too low).
+    """
+    ts = int(ts or snapshot.ts)
+    catalog = snapshot.catalog
+    return _write([
+        (catalog.names[store_id], ts, snapshot.men[store_id], snapshot.women[store_id],
+         catalog.sources[store_id], catalog.regions[store_id])
+        for store_id in snapshot.ids() if store_id not in snapshot.stale
+    ], ts, {catalog.regions[store_id] for store_id in snapshot.stale})
+
+
+def _write(rows, ts, partial_regions=()):
+    """partial_regions: regions missing stores in this poll; their totals are not rolled up."""
+    if not rows:
+        return 0
+
+    # Per-store values plus per-region totals of this poll
+    totals = [('store', name, men, women) for name, _, men, women, _, _ in rows]
+    regions = {}
+    for _, _, men, women, _, region in rows:
+        region_total = regions.setdefault(region or 'Other', [0, 0])
+        region_total[0] += men
+        region_total[1] += women
+    totals.extend(('region', region, men, women) for region, (men, women) in regions.items()
+                  if region not in partial_regions)
+
+    dow, hour = jst_slot(ts)
+    with connection() as conn, conn:
+        conn.executemany('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?)', rows)
+        for bucket_name, size in BUCKETS.items():
+            bucket = ts - ts % size
+            conn.executemany(
+                _ROLLUP_UPSERT.format(table=f'rollup_{bucket_name}'),
+                [(scope, key, bucket, men, women, men, women) for scope, key, men, women in totals]
+            )
+        conn.executemany(_DOW_UPSERT, [(scope, key, dow, hour, men, women) for scope, key, men, women in totals])
+    return len(rows)
+
+
+def query_rollup(scope, key, start, end, bucket='10m'):
+    """Returns [(ts, avg_men, avg_women, max_men, max_women), ...] from a rollup table."""
+    if bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket: {bucket}")
+    with connection() as conn:
+        return conn.execute(
+            f"""SELECT ts, CAST(men_sum AS REAL) / n, CAST(women_sum AS REAL) / n, men_max, women_max
+                FROM rollup_{bucket} WHERE scope = ? AND key = ? AND ts >= ? AND ts < ? ORDER BY ts""",
+            (scope, key, start, end)
+        ).fetchall()
+
+
+def query_weekly(scope, key):
+    """Returns [(dow, hour, avg_men, avg_women, samples), ...] for one store or region."""
+    with connection() as conn:
+        return conn.execute(
+            """SELECT dow, hour, CAST(men_sum AS REAL) / n, CAST(women_sum AS REAL) / n, n
+               FROM rollup_dow WHERE scope = ? AND key = ? ORDER BY dow, hour""",
+            (scope, key)
+        ).fetchall()
+
+
+def query_slot(scope, dow, hour, limit=10):
+    """Ranks stores (or regions) by average women at one day-of-week/hour slot."""
+    with connection() as conn:
+        return conn.execute(
+            """SELECT key, CAST(men_sum AS REAL) / n, CAST(women_sum AS REAL) / n, n
+               FROM rollup_dow WHERE scope = ? AND dow = ? AND hour = ?
+               ORDER BY women_sum * 1.0 / n DESC, men_sum * 1.0 / n DESC LIMIT ?""",
+            (scope, dow, hour, limit)
+        ).fetchall()
+
+
+def query(store, start, end):
+    """
+    Returns [(ts, men, women, average), ...] for one store in time order. Raw samples
+    have integer counts and average=False; where raw samples have been dropped the
+    range is filled from the 10 minute rollup, with average counts and average=True.
+    """
+    with connection() as conn:
+        rows = conn.execute(
+            'SELECT ts, men, women FROM samples WHERE store = ? AND ts >= ? AND ts < ? ORDER BY ts',
+            (store, start, end)
+        ).fetchall()
+    rows = [(ts, men, women, False) for ts, men, women in rows]
+    if rows and rows[0][0] - start < DOWNSAMPLE_BUCKET:
+        return rows
+    # Older range: fill in from the 10 minute rollup, stopping before the bucket
+    # that holds the first raw sample (that bucket would repeat it)
+    if rows:
+        first = rows[0][0]
+        end = first - first % DOWNSAMPLE_BUCKET
+    older = query_rollup('store', store, start, end)
+    return [(ts, men, women, True) for ts, men, women, _, _ in older] + rows
+
+
+def samples_since(cursor, limit=50000):
+    """Returns raw samples newer than cursor as [(ts, store, men, women, source), ...] ordered by ts."""
+    with connection() as conn:
+        return conn.execute(
+            'SELECT ts, store, men, women, source FROM samples WHERE ts > ? ORDER BY ts, store LIMIT ?',
+            (cursor, limit)
+        ).fetchall()
+
+
+def get_meta(key, default=None):
+    with connection() as conn:
+        row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_meta(key, value):
+    with connection() as conn, conn:
+        conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, str(value)))
+
+
+def apply_retention(now=None):
+    """Drops raw samples past RAW_RETENTION_DAYS and 10 minute rollups past DOWNSAMPLED_RETENTION_DAYS."""
+    now = int(now or time.time())
+    raw_cutoff = now - RAW_RETENTION_DAYS * 86400
+    # Only whole buckets are dropped, so query() never sees a half-covered bucket
+    raw_cutoff -= raw_cutoff % DOWNSAMPLE_BUCKET
+    downsampled_cutoff = now - DOWNSAMPLED_RETENTION_DAYS * 86400
+
+    with connection() as conn, conn:
+        removed = conn.execute('DELETE FROM samples WHERE ts < ?', (raw_cutoff,)).rowcount
+        conn.execute('DELETE FROM rollup_10m WHERE ts < ?', (downsampled_cutoff,))
+    if removed:
+        print(f"History retention: dropped {removed} raw samples.")
+    return removed
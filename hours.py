@@ -0,0 +1,21 @@
+import time
+
+# Business hours of the lounges in JST: 17:00 - 07:00 the next morning.
+# Shared by the polling schedule (monitor) and the Sheets export policy (logger).
+BUSINESS_HOURS_START = 17
+BUSINESS_HOURS_END = 7
+JST_OFFSET = 9 * 3600
+
+
+def is_business_hours(now=None):
+    hour = int(((now or time.time()) + JST_OFFSET) // 3600 % 24)
+    return hour >= BUSINESS_HOURS_START or hour < BUSINESS_HOURS_END
+
+
+
+def seconds_until_open(now=None):
+    """Seconds until business hours next start (0 while they are on)."""
+    now = now or time.time()
+    if is_business_hours(now):
+        return 0
+    return BUSINESS_HOURS_START * 3600 - (now + JST_OFFSET) % 86400
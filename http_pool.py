@@ -0,0 +1,73 @@
+import threading
+from urllib.parse import urlsplit
+
+# Keep-alive connections kept open per upstream host.
+# A refresh uses a single connection per host, and at most one /api/debug
+# sweep runs beside it. cloudscraper sessions serialize every call (see
+# _create_session), so they never need more than one.
+POOL_MAXSIZE = 2
+
+# Shared sessions keyed by (transport, host)
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _create_session(transport):
+    """Builds a session with a sized keep-alive pool for a single host."""
+    # Imported on first use: the HTTP stack is only needed once a worker scrapes
+    import requests
+    from requests.adapters import HTTPAdapter
+    if transport == 'cloudscraper':
+        import cloudscraper
+        session = cloudscraper.create_scraper()
+        # Re-mount the WAF cipher adapter with our pool size, keeping its TLS context
+        old = session.get_adapter('https://')
+        adapter = cloudscraper.CipherSuiteAdapter(
+            ssl_context=old.ssl_context,
+            source_address=old.source_address,
+            pool_connections=1,
+            pool_maxsize=1
+        )
+        session.mount('https://', adapter)
+        # cloudscraper keeps challenge state on the session, so calls are serialized
+        lock = threading.Lock()
+    else:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        lock = None
+    return {'session': session, 'lock': lock}
+
+
+def get_session(url, transport='cloudscraper'):
+    """Returns the shared session entry for the host of the given URL."""
+    key = (transport, urlsplit(url).netloc)
+    entry = _sessions.get(key)
+    if entry is None:
+        with _sessions_lock:
+            entry = _sessions.get(key)
+            if entry is None:
+                entry = _create_session(transport)
+                _sessions[key] = entry
+    return entry
+
+
+def get(url, transport='cloudscraper', **kwargs):
+    """
+    GETs a URL through the pooled session for its host.
+    transport: 'cloudscraper' for WAF-protected sites, 'plain' for bare requests.
+    """
+    entry = get_session(url, transport)
+    if entry['lock'] is None:
+        return entry['session'].get(url, **kwargs)
+    with entry['lock']:
+        return entry['session'].get(url, **kwargs)
+
+
+def close_all():
+    """Closes every pooled connection."""
+    with _sessions_lock:
+        for entry in _sessions.values():
+            entry['session'].close()
+        _sessions.clear()
@@ -1,8 +1,14 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import datetime
+import json
 import os
+import queue
+import random
 import sys
+import threading
+import time
+import history
+import hours
+import metrics
 
 # Constants
 # The user needs to put their JSON key here
@@ -10,8 +16,69 @@ CREDENTIALS_FILE = 'google_credentials.json'
 # The name of the Google Sheet to write to
 SHEET_NAME = 'Lounge Monitor Data' 
 
+# Sheet export policy: the local history store keeps every poll; the sheet gets
+# every poll during business hours (hours.py), never an all-zero one,
+# as a change-only log. Each row is [timestamp, store, men, women, source, kind]:
+#   K  keyframe: every store, at the first poll of each KEYFRAME_MINUTES window
+#      and after a gap in the log
+#   C  change: a store whose counts differ from its last row (blank counts = gone)
+#   E  end: the log stops after this timestamp (closing time, or a gap follows)
+# rebuild_series() turns the rows back into one sample per store per minute.
+KEYFRAME_MINUTES = 60
+# Polls further apart than this (seconds) break the log: an end row is written
+# for the last poll and the next one starts with a keyframe
+MAX_POLL_GAP = 180
+KEYFRAME = 'K'
+CHANGE = 'C'
+END = 'E'
+# Rows written before change-only logging (no kind column) were 10 minute samples
+LEGACY_SAMPLE_MINUTES = 10
+# history meta key holding the last exported sample timestamp
+EXPORT_CURSOR_KEY = 'sheets_cursor'
+# Maximum samples read from the history store per export
+EXPORT_BATCH_LIMIT = 50000
+
+# Writes go through one background worker. Batches waiting in its queue are
+# coalesced into a single append_rows call; when the sheet is unavailable they
+# are spilled to an on-disk journal, which is replayed (oldest first) with
+# exponential backoff until the sheet accepts it.
+# Re-authorize after this many seconds (access tokens last an hour)
+CLIENT_TTL = 45 * 60
+# Batches held in memory before callers are turned away
+QUEUE_BATCHES = 64
+# Rows per append_rows call
+MAX_APPEND_ROWS = 10000
+# Retry delays: RETRY_BASE * 2^failures seconds, capped at MAX_RETRY_DELAY
+RETRY_BASE = 10
+MAX_RETRY_DELAY = 1800
+JOURNAL_FILE = os.environ.get('SHEETS_JOURNAL', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sheets_journal.jsonl'))
+
+_sheet = None
+_sheet_opened_at = 0
+
+# Each queued batch is {'rows': [...], 'cursor': history timestamp or None}
+_queue = queue.Queue(maxsize=QUEUE_BATCHES)
+_worker = None
+_worker_lock = threading.Lock()
+# Highest history timestamp handed to the worker (the meta cursor lags until it is written)
+_submitted_cursor = None
+# Rows waiting in the queue and in the journal
+_pending = {'queued': 0, 'journal': 0}
+_pending_lock = threading.Lock()
+# Serializes journal appends (any thread) with replay rewrites (worker)
+_journal_lock = threading.Lock()
+_STOP = object()
+
+# What the sheet log ends with: last (men, women) written per store, the last
+# keyframe and the last poll logged. Updated only once rows are queued.
+_log_state = {'values': {}, 'keyframe_ts': None, 'last_ts': None}
+_log_lock = threading.Lock()
+
 def get_client():
     """Authenticates and returns the gspread client."""
+    # Imported on first export rather than at startup
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
     
     # Check for credentials in possible locations
@@ -40,37 +107,389 @@ def get_client():
         print(f"Google Sheets Auth Error: {e}", file=sys.stderr)
         return None
 
+def _to_jst(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=9)
+
+def _get_sheet():
+    """Returns the cached worksheet, authorizing again once CLIENT_TTL has passed."""
+    global _sheet, _sheet_opened_at
+    if _sheet is None or time.time() - _sheet_opened_at > CLIENT_TTL:
+        client = get_client()
+        if not client:
+            return None
+        _sheet = client.open(SHEET_NAME).sheet1
+        _sheet_opened_at = time.time()
+    return _sheet
+
+def _append_rows(rows):
+    """Appends rows to the sheet in one call. Returns False when the sheet is unavailable."""
+    global _sheet
+    try:
+        sheet = _get_sheet()
+        if sheet is None:
+            print("Skipping logging: No valid credentials or client.")
+            return False
+        sheet.append_rows(rows)
+        print(f"Logged {len(rows)} rows to Google Sheets.")
+        return True
+    except Exception as e:
+        # Expired token, revoked key or API error: authorize again on the next attempt
+        _sheet = None
+        print(f"Google Sheets Logging Error: {e}", file=sys.stderr)
+        return False
+
+def _format_ts(ts):
+    return _to_jst(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+def _sheet_wants(ts, total_guests):
+    if total_guests == 0:
+        return False
+    return hours.is_business_hours(ts)
+
+def _add_pending(kind, rows):
+    with _pending_lock:
+        _pending[kind] += rows
+
+def pending_rows():
+    """Rows not yet written to the sheet (queued in memory or journaled on disk)."""
+    return _pending['queued'] + _pending['journal']
+
+def get_stats():
+    return {
+        'queued_rows': _pending['queued'],
+        'journal_rows': _pending['journal'],
+        'queued_batches': _queue.qsize(),
+        'worker_alive': bool(_worker and _worker.is_alive())
+    }
+
+def _start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _pending['journal'] = sum(len(batch['rows']) for batch in _read_journal())
+            _worker = threading.Thread(target=_run_worker, name="sheets-writer", daemon=True)
+            _worker.start()
+
+def submit(rows, cursor=None):
+    """
+    Queues rows for the sheet without blocking. cursor is the history timestamp
+    the export cursor advances to once the rows are written or journaled.
+    Returns False when the queue is full (rows with a cursor stay in the history
+    store for the next export; rows without one go straight to the journal).
+    """
+    _start_worker()
+    try:
+        _queue.put_nowait({'rows': rows, 'cursor': cursor})
+    except queue.Full:
+        if cursor is None:
+            _spill([{'rows': rows, 'cursor': None}])
+        return False
+    _add_pending('queued', len(rows))
+    return True
+
+def _take(timeout):
+    """Waits for a batch, then drains queued batches up to MAX_APPEND_ROWS rows."""
+    try:
+        first = _queue.get(timeout=timeout)
+    except queue.Empty:
+        return [], False
+    if first is _STOP:
+        return [], True
+    batches = [first]
+    rows = len(first['rows'])
+    while rows < MAX_APPEND_ROWS:
+        try:
+            batch = _queue.get_nowait()
+        except queue.Empty:
+            break
+        if batch is _STOP:
+            return batches, True
+        batches.append(batch)
+        rows += len(batch['rows'])
+    return batches, False
+
+def _read_journal():
+    if not os.path.exists(JOURNAL_FILE):
+        return []
+    batches = []
+    with open(JOURNAL_FILE, encoding='utf-8') as f:
+        for line in f:
+            try:
+                batches.append(json.loads(line))
+            except ValueError:
+                # Torn last line from a crash mid-write
+                print("Skipping corrupt journal line", file=sys.stderr)
+    return batches
+
+def _write_journal(batches):
+    """Atomically replaces the journal with the given batches."""
+    if not batches:
+        if os.path.exists(JOURNAL_FILE):
+            os.remove(JOURNAL_FILE)
+        return
+    tmp = JOURNAL_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for batch in batches:
+            f.write(json.dumps(batch, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, JOURNAL_FILE)
+
+def _spill(batches):
+    """Appends batches to the journal and fsyncs it."""
+    with _journal_lock, open(JOURNAL_FILE, 'a', encoding='utf-8') as f:
+        for batch in batches:
+            f.write(json.dumps({'rows': batch['rows']}, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    _add_pending('journal', sum(len(batch['rows']) for batch in batches))
+
+def _advance_cursor(batches):
+    cursors = [batch['cursor'] for batch in batches if batch['cursor'] is not None]
+    if cursors:
+        history.set_meta(EXPORT_CURSOR_KEY, max(cursors))
+
+def _replay_journal():
+    """Appends journaled rows oldest first. Returns False if the sheet refused a chunk."""
+    with _journal_lock:
+        return _replay_locked()
+
+def _replay_locked():
+    batches = _read_journal()
+    while batches:
+        chunk = []
+        rows = []
+        while batches and (not rows or len(rows) + len(batches[0]['rows']) <= MAX_APPEND_ROWS):
+            chunk.append(batches.pop(0))
+            rows.extend(chunk[-1]['rows'])
+        if rows and not _append_rows(rows):
+            return False
+        # Drop what was written right away so a later failure cannot repeat it
+        _write_journal(batches)
+        _add_pending('journal', -len(rows))
+    _pending['journal'] = 0
+    return True
+
+def _run_worker():
+    failures = 0
+    retry_at = 0
+    # Batches an error (full disk, locked history db) kept from being written or
+    # journaled; retried ahead of newer batches so none are dropped
+    held = []
+    # Batches written or journaled whose export cursor is not saved yet
+    unsaved = []
+    while True:
+        journal_pending = os.path.exists(JOURNAL_FILE)
+        waiting = journal_pending or held or unsaved
+        timeout = max(0.0, retry_at - time.time()) if waiting else None
+        batches, stopping = _take(timeout)
+        batches = held + batches
+        rows = [row for batch in batches for row in batch['rows']]
+
+        try:
+            if journal_pending or time.time() < retry_at:
+                # Keep sheet order: new rows queue up behind the journal
+                if rows:
+                    _spill(batches)
+                ok = None
+            else:
+                ok = _append_rows(rows) if rows else True
+                if not ok:
+                    _spill(batches)
+        except Exception as e:
+            print(f"Sheets writer error, batches kept for retry: {e}", file=sys.stderr)
+            held = batches
+            ok = False
+        else:
+            held = []
+            _add_pending('queued', -len(rows))
+            # Written or durably journaled either way
+            unsaved.extend(batches)
+            if ok is None and time.time() >= retry_at and not stopping:
+                try:
+                    ok = _replay_journal()
+                except Exception as e:
+                    print(f"Sheets journal replay error: {e}", file=sys.stderr)
+                    ok = False
+        try:
+            _advance_cursor(unsaved)
+            unsaved = []
+        except Exception as e:
+            print(f"Could not save the Sheets export cursor: {e}", file=sys.stderr)
+            ok = False
+
+        if ok is False:
+            failures += 1
+            delay = min(MAX_RETRY_DELAY, RETRY_BASE * 2 ** (failures - 1))
+            retry_at = time.time() + delay * random.uniform(0.8, 1.2)
+            print(f"Sheets unavailable, journaled rows retry in {delay}s", file=sys.stderr)
+        elif ok:
+            failures = 0
+            retry_at = 0
+        if stopping:
+            return
+
+def stop(timeout=5):
+    """Lets the worker finish the queued batches (journaling what it cannot write)."""
+    if _worker is not None and _worker.is_alive():
+        try:
+            _queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        _worker.join(timeout)
+
+def _encode_polls(polls, state):
+    """
+    Turns {ts: [(store, men, women, source), ...]} into change-only rows.
+    state is a copy of _log_state and is advanced past the polls.
+    """
+    rows = []
+    for ts in sorted(polls):
+        items = polls[ts]
+        wanted = _sheet_wants(ts, sum(men + women for _, men, women, _ in items))
+        last_ts = state['last_ts']
+        if last_ts is not None and (not wanted or ts - last_ts > MAX_POLL_GAP):
+            rows.append([_format_ts(last_ts), '', '', '', '', END])
+            state.update(values={}, keyframe_ts=None, last_ts=None)
+        if not wanted:
+            continue
+
+        timestamp_str = _format_ts(ts)
+        window = KEYFRAME_MINUTES * 60
+        values = state['values']
+        if state['keyframe_ts'] is None or ts // window != state['keyframe_ts'] // window:
+            rows.extend([timestamp_str, store, men, women, source, KEYFRAME] for store, men, women, source in items)
+            values = {store: (men, women, source) for store, men, women, source in items}
+            state['keyframe_ts'] = ts
+        else:
+            values = dict(values)
+            seen = set()
+            for store, men, women, source in items:
+                seen.add(store)
+                if values.get(store, (None, None))[:2] != (men, women):
+                    rows.append([timestamp_str, store, men, women, source, CHANGE])
+                    values[store] = (men, women, source)
+            for store in [store for store in values if store not in seen]:
+                rows.append([timestamp_str, store, '', '', values.pop(store)[2], CHANGE])
+        state['values'] = values
+        state['last_ts'] = ts
+    return rows
+
+def export_history():
+    """
+    Queues samples recorded in the history store since the last export for
+    Google Sheets as change-only rows (see the export policy above). The cursor
+    advances once the worker has written or journaled them, so nothing is lost
+    on a crash. Returns the number of rows queued.
+    """
+    global _submitted_cursor, _log_state
+    with _log_lock:
+        cursor = int(history.get_meta(EXPORT_CURSOR_KEY, int(time.time()) - 3600))
+        if _submitted_cursor is not None:
+            cursor = max(cursor, _submitted_cursor)
+        samples = history.samples_since(cursor, EXPORT_BATCH_LIMIT)
+        if len(samples) == EXPORT_BATCH_LIMIT:
+            # Leave a possibly truncated last poll for the next export
+            last_ts = samples[-1][0]
+            samples = [sample for sample in samples if sample[0] != last_ts]
+        if not samples:
+            return 0
+
+        # Group samples by poll timestamp
+        polls = {}
+        for ts, store, men, women, source in samples:
+            polls.setdefault(ts, []).append((store, men, women, source))
+
+        state = dict(_log_state)
+        rows_to_append = _encode_polls(polls, state)
+
+        # Batches without rows still carry the cursor past the skipped polls
+        if not submit(rows_to_append, max(polls)):
+            print("Sheets queue full, export deferred.", file=sys.stderr)
+            return 0
+        _submitted_cursor = max(polls)
+        _log_state = state
+        return len(rows_to_append)
+
 def log_data(data):
     """
-    Logs the provided data to Google Sheets.
+    Queues the provided data for Google Sheets as change-only rows.
     data: list of dicts [{'name': '...', 'men': 10, 'women': 10, 'source': '...'}, ...]
     """
-    client = get_client()
-    if not client:
-        print("Skipping logging: No valid credentials or client.")
-        return
+    global _log_state
+    poll = [(item.get('name', ''), item.get('men', 0), item.get('women', 0), item.get('source', '')) for item in data]
+    with _log_lock:
+        state = dict(_log_state)
+        rows_to_append = _encode_polls({int(time.time()): poll}, state)
+        if rows_to_append:
+            submit(rows_to_append)
+        _log_state = state
 
+def _parse_sheet_ts(value):
     try:
-        sheet = client.open(SHEET_NAME).sheet1
-        
-        # timestamp
-        now = datetime.datetime.now() + datetime.timedelta(hours=9) # JST
-        timestamp_str = now.strftime("%Y-%m-%d %H:%M:%S")
-        
-        rows_to_append = []
-        for item in data:
-            row = [
-                timestamp_str,
-                item.get('name', ''),
-                item.get('men', 0),
-                item.get('women', 0),
-                item.get('source', '')
-            ]
-            rows_to_append.append(row)
-            
-        if rows_to_append:
-            sheet.append_rows(rows_to_append)
-            print(f"Logged {len(rows_to_append)} rows to Google Sheets.")
-            
-    except Exception as e:
-        print(f"Google Sheets Logging Error: {e}", file=sys.stderr)
+        jst_time = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+    # Seconds on the JST wall clock; only differences and formatting matter here
+    return int(jst_time.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+def rebuild_series(rows, step=60):
+    """
+    Rebuilds per-store time series from sheet rows (worksheet.get_all_values(),
+    header rows are skipped). Rows without a kind column are 10 minute samples
+    written before change-only logging.
+    Returns {store: [(timestamp, men, women), ...]} with one sample every step
+    seconds while the log was running.
+    """
+    groups = {}
+    for row in rows:
+        ts = _parse_sheet_ts(row[0] if row else None)
+        if ts is None:
+            continue
+        kind = row[5] if len(row) > 5 and row[5] else None
+        groups.setdefault(ts, []).append((row[1], row[2], row[3], kind))
+
+    series = {}
+    current = {}
+    valid_until = None
+    times = sorted(groups)
+    for index, ts in enumerate(times):
+        group = groups[ts]
+        kinds = {kind for _, _, _, kind in group}
+        if KEYFRAME in kinds or None in kinds:
+            current = {}
+            minutes = KEYFRAME_MINUTES if KEYFRAME in kinds else LEGACY_SAMPLE_MINUTES
+            valid_until = ts + minutes * 60
+        for store, men, women, kind in group:
+            if kind == END:
+                continue
+            if kind == CHANGE and men == '' and women == '':
+                current.pop(store, None)
+            else:
+                current[store] = (int(men), int(women))
+        # After an end row the counts held up to this poll and nothing is known later
+        end = ts if END in kinds else None
+
+        next_ts = times[index + 1] if index + 1 < len(times) else None
+        stop = end if end is not None else valid_until
+        if next_ts is not None:
+            stop = min(stop, next_ts - 1) if stop is not None else next_ts - 1
+        t = ts
+        while stop is not None and t <= stop:
+            timestamp = datetime.datetime.fromtimestamp(t, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            for store, (men, women) in current.items():
+                series.setdefault(store, []).append((timestamp, men, women))
+            t += step
+        if end is not None:
+            current = {}
+            valid_until = None
+    return series
+
+def load_series(step=60):
+    """Reads the whole sheet and rebuilds its per-store time series."""
+    sheet = _get_sheet()
+    if sheet is None:
+        return {}
+    return rebuild_series(sheet.get_all_values(), step)
+
+metrics.logger_queue_depth.callback = pending_rows
@@ -0,0 +1,207 @@
+import bisect
+import threading
+import time
+
+# In-process counters, gauges and histograms, rendered in the Prometheus text
+# exposition format by /metrics. Recording is a dict update under a lock, so it
+# is cheap enough for the hot paths; nothing here touches the network.
+# With several workers each one publishes dump() (see shared.py) and /metrics
+# renders the sum over all live workers, so any worker answers for the host.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _key(pairs):
+    return tuple(tuple(pair) for pair in pairs)
+
+
+def _dump_values(values):
+    return [[list(key), value] for key, value in values.items()]
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dump(self):
+        return _dump_values(self.values)
+
+    def render(self, others=()):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        values = dict(self.values)
+        for other in others:
+            for pairs, value in other.get(self.name, []):
+                key = _key(pairs)
+                values[key] = values.get(key, 0) + value
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(key)} {_format_value(value)}')
+        return lines
+
+
+class Gauge:
+    """A gauge set directly, or read from callback() at render time."""
+
+    def __init__(self, name, documentation, callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.values = {}
+        _registry.append(self)
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[_label_key(labels)] = value
+
+    def _values(self):
+        values = dict(self.values)
+        if self.callback is not None:
+            try:
+                values[()] = self.callback()
+            except Exception:
+                pass
+        return values
+
+    def dump(self):
+        return _dump_values(self._values())
+
+    def render(self, others=()):
+        # Summed over workers: gauges here are counts (clients, queued rows)
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        values = self._values()
+        for other in others:
+            for pairs, value in other.get(self.name, []):
+                key = _key(pairs)
+                values[key] = values.get(key, 0) + value
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self.values = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing the elapsed seconds of its block."""
+        return _Timer(self, labels)
+
+    def dump(self):
+        return _dump_values(self.values)
+
+    def render(self, others=()):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        values = {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+        for other in others:
+            for pairs, (counts, total, count) in other.get(self.name, []):
+                key = _key(pairs)
+                mine = values.get(key)
+                if mine is None:
+                    values[key] = (list(counts), total, count)
+                else:
+                    values[key] = ([a + b for a, b in zip(mine[0], counts)], mine[1] + total, mine[2] + count)
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", _format_value(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def dump():
+    """This process's values as a JSON-serializable {metric name: [[labels, value], ...]}."""
+    with _lock:
+        return {metric.name: metric.dump() for metric in _registry}
+
+
+def render(others=()):
+    """
+    Returns every registered metric in the Prometheus text format.
+    others: dump() results of other workers, added to this process's values.
+    """
+    with _lock:
+        lines = []
+        for metric in _registry:
+            lines.extend(metric.render(others))
+    return '\n'.join(lines) + '\n'
+
+
+# Shared metrics recorded across modules
+source_fetch_seconds = Histogram('lounge_source_fetch_seconds', 'Time to fetch and parse one source')
+source_parse_seconds = Histogram('lounge_source_parse_seconds', 'Time spent parsing a source payload')
+source_response_bytes = Histogram('lounge_source_response_bytes', 'Size of source response bodies', BYTES_BUCKETS)
+source_polls = Counter('lounge_source_polls_total', 'Source polls by outcome')
+source_errors = Counter('lounge_source_errors_total', 'Failed source fetches')
+source_cache = Counter('lounge_source_cache_total', 'Conditional request / content hash results (hit skips parsing)')
+refresh_seconds = Histogram('lounge_refresh_seconds', 'End-to-end refresh time')
+refresh_skipped = Counter('lounge_refresh_skipped_total', 'Refreshes skipped because one was already running')
+scheduler_lag_seconds = Histogram('lounge_scheduler_lag_seconds', 'Delay between a job\'s scheduled and actual start')
+scheduler_missed = Counter('lounge_scheduler_missed_total', 'Scheduled runs missed or skipped by the scheduler')
+status_seconds = Histogram('lounge_status_request_seconds', '/api/status handling time')
+status_responses = Counter('lounge_status_responses_total', '/api/status responses by result (not_modified = cache hit)')
+logger_queue_depth = Gauge('lounge_logger_queue_depth', 'Rows waiting to be written to Google Sheets')
+logger_queue_depth.set(0)
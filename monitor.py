@@ -1,12 +1,16 @@
-import requests
-import cloudscraper
-from bs4 import BeautifulSoup
 import time
 from datetime import datetime
 import sys
-
-# Create a cloudscraper instance to bypass WAFs
-scraper = cloudscraper.create_scraper()
+import json
+import hashlib
+import threading
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+import hours
+import http_pool
+import extract
+import metrics
 
 # URLs to monitor
 ORIENTAL_URL = "https://oriental-lounge.com/"
@@ -15,228 +19,622 @@ XIX_URL = "https://aiseki-okayama.conohawing.com/aiseki/parts/get_cs_info.php"
 ALFA_URL = "https://aiseki-hiroshima.com/wp/display.php"
 YATAKOI_URL = "https://asobibar-823d1.firebaseio.com/shops/chayamachi.json"
 
+# Use the streaming extractors in extract.py before falling back to BeautifulSoup
+FAST_PARSE = True
+
+# Browser User-Agent for sites that reject the requests default
+BROWSER_UA = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36'
+
+# Map JIS store keys to readable names, otherwise the key is uppercased
+JIS_NAME_MAP = {
+    'sapporo_b1': 'SAPPORO',
+    'omiya': 'OMIYA',
+    'shinjuku': 'SHINJUKU',
+    'nishishinjuku': 'NISHISHINJUKU',
+    'umeda': 'UMEDA',
+    'namba': 'NAMBA',
+    'chayamachi': 'CHAYAMACHI',
+    'fukuoka': 'FUKUOKA',
+    'kumamoto': 'KUMAMOTO',
+    'matsuyama': 'MATSUYAMA'
+}
+
+# Default seconds between polls of a source during business hours
+DEFAULT_INTERVAL = 60
+# A source is due this many seconds early so that scheduler jitter does not skip a poll
+POLL_SLACK = 5
+
+# Adaptive polling (see next_interval):
+# Outside business hours (hours.py) sources are polled OFF_PEAK_FACTOR times
+# less often, and a source whose counts have not changed for several polls
+# backs off further, up to MAX_OFF_PEAK_INTERVAL.
+OFF_PEAK_FACTOR = 5
+QUIET_POLLS = 3
+MAX_OFF_PEAK_INTERVAL = 1800
+# Off-peak, sources slower than this (seconds, moving average) are polled half as often
+SLOW_LATENCY = 5
+# Failed polls back off exponentially with jitter, at any hour
+MAX_BACKOFF = 900
+LATENCY_SMOOTHING = 0.3
+
+# Circuit breaker per source: after FAILURE_THRESHOLD consecutive failures the
+# breaker opens and the source is not contacted until its backoff expires; the
+# next poll is a single half-open trial that closes the breaker on success.
+FAILURE_THRESHOLD = 3
+# While a source is failing its last good rows are served, marked stale, for this long
+LAST_GOOD_MAX_AGE = 3600
+# Polls kept for the rolling success rate and latency statistics
+HEALTH_WINDOW = 100
+
+# Source registry. Each entry declares how one chain is fetched and parsed:
+#   url, transport ('cloudscraper' or 'plain'), headers, timeout, interval (seconds)
+#   parser: 'css'           -> item: 'tag.class' card selector, fields: {field: 'tag' or '.class'}
+#           'embedded_json' -> variable: name in `var <name> = {...};`, one store per key
+#           'json_api'      -> root: path to the store object, store_name: fixed store name
+#   fields for JSON parsers map men/women to a list of paths whose values are summed,
+#   paths are '/'-separated keys (digits index lists).
+#   require: path that must exist for a JSON item to count as a store
+#   prefix, name_map, upper: turn the raw store name / key into the display name
+SOURCES = {}
+
+def register_source(name, **spec):
+    """Adds or replaces a source in the registry."""
+    spec.setdefault('transport', 'cloudscraper')
+    spec.setdefault('timeout', 10)
+    spec.setdefault('interval', DEFAULT_INTERVAL)
+    spec.setdefault('prefix', '')
+    spec.setdefault('label', name)
+    if spec['parser'] == 'css':
+        spec['_item'] = extract.parse_simple_selector(spec['item'])
+    elif spec['parser'] == 'embedded_json':
+        spec['_pattern'] = extract.compile_assignment(spec['variable'])
+    SOURCES[name] = spec
+    return spec
+
+register_source(
+    'oriental',
+    label='Oriental',
+    url=ORIENTAL_URL,
+    parser='css',
+    item='a.card.wave-anime-wrap',
+    fields={'name': 'h4', 'men': '.num-male', 'women': '.num-female'},
+    prefix='OLG ',
+    timeout=10
+)
+register_source(
+    'jis',
+    label='JIS',
+    url=JIS_URL,
+    # JIS usually requires User-Agent
+    transport='plain',
+    headers={'User-Agent': BROWSER_UA},
+    parser='embedded_json',
+    variable='datas',
+    require='shared',
+    fields={'men': ['shared/mens_customer_num'], 'women': ['shared/ladys_customer_num']},
+    name_map=JIS_NAME_MAP,
+    upper=True,
+    prefix='JIS ',
+    timeout=10
+)
+register_source(
+    'xix',
+    label='XIX',
+    url=XIX_URL,
+    parser='json_api',
+    # XIX API returns a list of objects, we take the first one
+    root='0',
+    fields={'men': ['m_cnt'], 'women': ['w_cnt']},
+    store_name='XIX OKAYAMA',
+    timeout=8
+)
+register_source(
+    'alfa',
+    label='ALFA',
+    url=ALFA_URL,
+    parser='json_api',
+    fields={'men': ['man_num'], 'women': ['woman_num']},
+    store_name='ALFA HIROSHIMA',
+    timeout=8
+)
+register_source(
+    'yatakoi',
+    label='Yatakoi',
+    url=YATAKOI_URL,
+    parser='json_api',
+    # Some stores have extra 'ykMales'/'ykFemales' to add
+    fields={'men': ['males', 'ykMales'], 'women': ['females', 'ykFemales']},
+    store_name='YATAKOI UMEDA',
+    timeout=5
+)
+
+# Overall deadline for one refresh. Sources still running after this are
+# reported as timed out and left out of the result.
+REFRESH_DEADLINE = 15
+
+# Validators, body hash and parsed rows of the last good response per source
+_response_cache = {}
+_cache_lock = threading.Lock()
+# Per-source counters: hits skip parsing, misses parse the body
+_cache_stats = {}
+
+def _count_cache(name, hit, bytes_saved=0):
+    metrics.source_cache.inc(source=name, result='hit' if hit else 'miss')
+    with _cache_lock:
+        stats = _cache_stats.setdefault(name, {'hits': 0, 'misses': 0, 'bytes_saved': 0})
+        stats['hits' if hit else 'misses'] += 1
+        stats['bytes_saved'] += bytes_saved
+
+def _conditional_get(name, url, transport='cloudscraper', headers=None, **kwargs):
+    """
+    GETs a source URL with If-None-Match / If-Modified-Since from its last response.
+    Returns (response, digest, cached_rows). cached_rows is a fresh copy of the
+    previously parsed rows when the server answered 304 or the body hash is unchanged,
+    otherwise None and the caller must parse the body.
+    """
+    headers = dict(headers or {})
+    cached = _response_cache.get(name)
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    response = http_pool.get(url, transport, headers=headers, **kwargs)
+    metrics.source_response_bytes.observe(len(response.content), source=name)
+    if cached and response.status_code == 304:
+        _count_cache(name, True, cached['size'])
+        return response, cached['digest'], [dict(row) for row in cached['rows']]
+
+    digest = hashlib.sha1(response.content).hexdigest()
+    if cached and cached['digest'] == digest:
+        _count_cache(name, True)
+        _remember(name, response, digest, cached['rows'])
+        return response, digest, [dict(row) for row in cached['rows']]
+
+    _count_cache(name, False)
+    return response, digest, None
+
+def _remember(name, response, digest, rows):
+    """Stores validators and parsed rows so the next unchanged payload can skip parsing."""
+    if not rows:
+        return
+    _response_cache[name] = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'digest': digest,
+        'size': len(response.content),
+        'rows': [dict(row) for row in rows]
+    }
+
+def get_cache_stats():
+    """Returns per-source conditional request / content hash hit and miss counters."""
+    with _cache_lock:
+        return {name: dict(stats) for name, stats in _cache_stats.items()}
+
+# One diagnostic sweep (/api/debug) at a time: each holds the per-host sessions
+# the scheduled refresh needs
+_debug_lock = threading.Lock()
+
 def debug_connections():
     results = {}
-    urls = {
-        "Oriental": ORIENTAL_URL,
-        "JIS": JIS_URL,
-        "XIX": XIX_URL,
-        "ALFA": ALFA_URL,
-        "YATAKOI": YATAKOI_URL
-    }
-    
-    for name, url in urls.items():
-        try:
-            start = time.time()
-            resp = scraper.get(url, timeout=10)
-            duration = time.time() - start
-            results[name] = {
-                "status": resp.status_code,
-                "time": f"{duration:.2f}s",
-                "length": len(resp.content)
-            }
-        except Exception as e:
-            results[name] = {"error": str(e)}
+    with _debug_lock:
+        for name, source in SOURCES.items():
+            try:
+                start = time.time()
+                resp = http_pool.get(source['url'], source['transport'], headers=source.get('headers'), timeout=10)
+                duration = time.time() - start
+                results[name] = {
+                    "status": resp.status_code,
+                    "time": f"{duration:.2f}s",
+                    "length": len(resp.content)
+                }
+            except Exception as e:
+                results[name] = {"error": str(e)}
             
     return results
 
-def get_oriental_data():
-    try:
-        # Use scraper instead of requests
-        response = scraper.get(ORIENTAL_URL, timeout=10)
-        response.raise_for_status()
-    except Exception as e:
-        print(f"Error fetching Oriental data: {e}", file=sys.stderr)
-        return []
+def _lookup(data, path):
+    """Follows a '/'-separated path through dicts and lists. Returns None when missing."""
+    for key in path.split('/'):
+        if isinstance(data, list):
+            if not key.isdigit() or int(key) >= len(data):
+                return None
+            data = data[int(key)]
+        elif isinstance(data, dict):
+            data = data.get(key)
+        else:
+            return None
+        if data is None:
+            return None
+    return data
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-    
-    # Stores are in 'a' tags with class 'card' and 'wave-anime-wrap'
-    stores = soup.select('a.card.wave-anime-wrap')
-    
+def _count(item, paths):
+    return sum(int(_lookup(item, path) or 0) for path in paths)
+
+def _row(source, name, men, women):
+    if name in source.get('name_map', {}):
+        name = source['name_map'][name]
+    elif source.get('upper'):
+        name = name.upper()
+    return {
+        'name': f"{source['prefix']}{name}",
+        'men': men,
+        'women': women,
+        'source': source['source']
+    }
+
+def _json_rows(source, items):
+    """Turns {key: item} into store rows using the source's field mapping."""
+    store_data = []
+    for key, item in items:
+        if source.get('require') and _lookup(item, source['require']) is None:
+            continue
+        try:
+            men_count = _count(item, source['fields']['men'])
+            women_count = _count(item, source['fields']['women'])
+        except (TypeError, ValueError):
+            continue
+        store_data.append(_row(source, key, men_count, women_count))
+    return store_data
+
+def _parse_css_fast(source, content):
+    store_data = []
+    for card in extract.extract_cards(content.decode('utf-8'), source['_item'], source['fields']):
+        if 'name' not in card:
+            continue
+        try:
+            men_count = int(card['men']) if 'men' in card else 0
+            women_count = int(card['women']) if 'women' in card else 0
+        except ValueError:
+            continue
+        store_data.append(_row(source, card['name'], men_count, women_count))
+    return store_data
+
+def _soup(content):
+    # bs4 is only needed when a fast parser fails, so it is not imported at startup
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(content, 'html.parser')
+
+def _parse_css_soup(source, content):
+    soup = _soup(content)
+    fields = source['fields']
     store_data = []
     
-    for store in stores:
+    for store in soup.select(source['item']):
         try:
-            name_tag = store.select_one('h4')
+            name_tag = store.select_one(fields['name'])
             if not name_tag:
                 continue
             name = name_tag.get_text(strip=True)
             
-            # Men count
-            men_tag = store.select_one('.num-male')
+            men_tag = store.select_one(fields['men'])
             men_count = int(men_tag.get_text(strip=True)) if men_tag else 0
             
-            # Women count
-            women_tag = store.select_one('.num-female')
+            women_tag = store.select_one(fields['women'])
             women_count = int(women_tag.get_text(strip=True)) if women_tag else 0
             
-            store_data.append({
-                'name': f"OLG {name}",
-                'men': men_count,
-                'women': women_count,
-                'source': 'oriental'
-            })
+            store_data.append(_row(source, name, men_count, women_count))
         except ValueError:
             continue
             
     return store_data
 
-
-def get_jis_data():
+def _embedded_rows(source, json_str):
     try:
-        # JIS usually requires User-Agent
-        headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36'}
-        response = requests.get(JIS_URL, headers=headers, timeout=10)
-        response.raise_for_status()
-    except requests.RequestException as e:
-        print(f"Error fetching JIS data: {e}", file=sys.stderr)
+        data = json.loads(json_str)
+    except json.JSONDecodeError as e:
+        print(f"Error parsing {source['label']} JSON: {e}", file=sys.stderr)
         return []
+    return _json_rows(source, data.items())
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-    
-    # JIS data is in a script tag with "var datas ="
-    scripts = soup.find_all('script')
-    target_script = None
-    for script in scripts:
-        if script.string and 'var datas =' in script.string:
-            target_script = script.string
-            break
-            
-    if not target_script:
-        print("Could not find JIS data script", file=sys.stderr)
+def _parse_embedded_fast(source, content):
+    # Find the assignment directly in the raw page without building a tree
+    json_str = extract.extract_assignment(content.decode('utf-8', errors='replace'), source['_pattern'])
+    return _embedded_rows(source, json_str) if json_str else []
+
+def _parse_embedded_soup(source, content):
+    soup = _soup(content)
+    marker = f"var {source['variable']} ="
+    for script in soup.find_all('script'):
+        if script.string and marker in script.string:
+            json_str = extract.extract_assignment(script.string, source['_pattern'])
+            return _embedded_rows(source, json_str) if json_str else []
+    print(f"Could not find {source['label']} data script", file=sys.stderr)
+    return []
+
+def _parse_json_api(source, content):
+    # utf-8-sig also handles the UTF-8 BOM some endpoints send
+    data = json.loads(content.decode('utf-8-sig'))
+    item = _lookup(data, source['root']) if source.get('root') else data
+    if not item:
         return []
+    return _json_rows(source, [(source['store_name'], item)])
 
-    store_data = []
-    
-    # Extract JSON string: var datas = { ... };
-    import re
-    import json
-    
-    match = re.search(r'var datas\s*=\s*({.*?});', target_script, re.DOTALL)
-    if match:
-        json_str = match.group(1)
+# parser kind -> (fast path, reference path)
+PARSERS = {
+    'css': (_parse_css_fast, _parse_css_soup),
+    'embedded_json': (_parse_embedded_fast, _parse_embedded_soup),
+    'json_api': (None, _parse_json_api)
+}
+
+def parse_payload(name, content, fast=None):
+    """
+    Parses a raw response body for a registered source into store rows.
+    The fast path is tried first (unless fast=False) and the reference parser is
+    used whenever it fails or finds nothing.
+    """
+    source = dict(SOURCES[name], source=name)
+    fast_parser, parser = PARSERS[source['parser']]
+    if fast is None:
+        fast = FAST_PARSE
+    if fast and fast_parser:
         try:
-            data = json.loads(json_str)
-            for store_key, store_info in data.items():
-                if 'shared' in store_info:
-                    men_count = store_info['shared'].get('mens_customer_num', 0)
-                    women_count = store_info['shared'].get('ladys_customer_num', 0)
-                    
-                    # Map store keys to readable names if possible, or uppercase key
-                    name_map = {
-                        'sapporo_b1': 'SAPPORO',
-                        'omiya': 'OMIYA',
-                        'shinjuku': 'SHINJUKU',
-                        'nishishinjuku': 'NISHISHINJUKU',
-                        'umeda': 'UMEDA',
-                        'namba': 'NAMBA',
-                        'chayamachi': 'CHAYAMACHI',
-                        'fukuoka': 'FUKUOKA',
-                        'kumamoto': 'KUMAMOTO',
-                        'matsuyama': 'MATSUYAMA'
-                    }
-                    name = name_map.get(store_key, store_key.upper())
-                    
-                    store_data.append({
-                        'name': f"JIS {name}",
-                        'men': men_count,
-                        'women': women_count,
-                        'source': 'jis'
-                    })
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JIS JSON: {e}", file=sys.stderr)
-            
+            store_data = fast_parser(source, content)
+            if store_data:
+                return store_data
+        except Exception as e:
+            print(f"{source['label']} fast parse failed, falling back: {e}", file=sys.stderr)
+    return parser(source, content)
+
+class SourceError(Exception):
+    """A source could not be fetched or its payload held no stores."""
+
+def _fetch_source(name, timeout=None):
+    """Fetches and parses one registered source. Raises on failure."""
+    source = SOURCES[name]
+    response, digest, cached = _conditional_get(
+        name,
+        source['url'],
+        source['transport'],
+        headers=source.get('headers'),
+        timeout=timeout or source['timeout']
+    )
+    response.raise_for_status()
+    if cached is not None:
+        return cached
+    with metrics.source_parse_seconds.time(source=name):
+        store_data = parse_payload(name, response.content)
+    if not store_data:
+        # Every source lists at least one store, so an empty parse means a block page or a layout change
+        raise SourceError("no stores found in response")
+    _remember(name, response, digest, store_data)
     return store_data
 
-def get_xix_data():
+def fetch_source(name, timeout=None):
+    """Fetches and parses one registered source. Returns [] on any error."""
     try:
-        response = scraper.get(XIX_URL, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        # XIX API returns a list of objects, we take the first one
-        if data and len(data) > 0:
-            info = data[0]
-            men_count = int(info.get('m_cnt', 0))
-            women_count = int(info.get('w_cnt', 0))
-            return [{
-                'name': "XIX OKAYAMA",
-                'men': men_count,
-                'women': women_count,
-                'source': 'xix'
-            }]
+        return _fetch_source(name, timeout)
     except Exception as e:
-        print(f"Error fetching XIX data: {e}", file=sys.stderr)
+        print(f"Error fetching {SOURCES[name]['label']} data: {e}", file=sys.stderr)
     return []
 
-def get_alfa_data():
-    try:
-        response = scraper.get(ALFA_URL, timeout=10)
-        response.raise_for_status()
-        # Handle UTF-8 BOM if present
-        try:
-            data = response.json()
-        except Exception:
-            import json
-            data = json.loads(response.content.decode('utf-8-sig'))
-        
-        men_count = int(data.get('man_num', 0))
-        women_count = int(data.get('woman_num', 0))
-        
-        return [{
-            'name': "ALFA HIROSHIMA",
-            'men': men_count,
-            'women': women_count,
-            'source': 'alfa'
-        }]
-    except Exception as e:
-        print(f"Error fetching ALFA data: {e}", file=sys.stderr)
-    return []
+def get_oriental_data(timeout=None):
+    return fetch_source('oriental', timeout)
+
+def get_jis_data(timeout=None):
+    return fetch_source('jis', timeout)
+
+def get_xix_data(timeout=None):
+    return fetch_source('xix', timeout)
+
+def get_alfa_data(timeout=None):
+    return fetch_source('alfa', timeout)
+
+def get_yatakoi_data(timeout=None):
+    return fetch_source('yatakoi', timeout)
+
+# Sized so that a source stuck past the deadline does not starve the next refresh
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fetch")
+
+# Per-source polling and health state: next poll time, breaker state, consecutive
+# failures, polls without a change in counts, smoothed latency, the last good rows
+# and a rolling window of (ok, latency) results.
+_poll_state = {}
 
-def get_yatakoi_data():
+def _run_source(name):
+    start = time.time()
     try:
-        response = scraper.get(YATAKOI_URL, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data:
-            men = int(data.get('males', 0))
-            women = int(data.get('females', 0))
-            # Some stores might have extra 'ykMales'/'ykFemales' to add
-            yk_men = int(data.get('ykMales', 0))
-            yk_women = int(data.get('ykFemales', 0))
-            
-            return [{
-                'name': "YATAKOI UMEDA",
-                'men': men + yk_men,
-                'women': women + yk_women,
-                'source': 'yatakoi'
-            }]
+        result = _fetch_source(name)
+        error = None
     except Exception as e:
-        print(f"Error fetching Yatakoi data: {e}", file=sys.stderr)
-    return []
+        print(f"Error fetching {SOURCES[name]['label']} data: {e}", file=sys.stderr)
+        metrics.source_errors.inc(source=name)
+        result = None
+        error = str(e)
+    duration = time.time() - start
+    metrics.source_fetch_seconds.observe(duration, source=name)
+    return result, error, duration
+
+def _state(name):
+    state = _poll_state.get(name)
+    if state is None:
+        state = _poll_state[name] = {
+            'next_poll': 0,
+            'breaker': 'closed',
+            'failures': 0,
+            'unchanged': 0,
+            'latency': None,
+            'last_good': [],
+            'last_good_at': None,
+            'last_error': None,
+            'recent': deque(maxlen=HEALTH_WINDOW)
+        }
+    return state
+
+def next_interval(name, now=None):
+    """
+    Seconds until the next poll of a source, from business hours, how often its
+    counts changed recently, its latency, and its recent failures.
+    During business hours a healthy source is always polled at its base interval,
+    and an off-peak poll is never scheduled later than their start.
+    """
+    source = SOURCES[name]
+    state = _state(name)
+    base = source['interval']
+
+    if state['failures']:
+        # Exponential backoff with jitter so retries do not line up
+        backoff = min(MAX_BACKOFF, base * 2 ** state['failures'])
+        return max(base, backoff * random.uniform(0.5, 1.0))
+
+    if hours.is_business_hours(now):
+        return base
+
+    interval = base * OFF_PEAK_FACTOR
+    if state['unchanged'] >= QUIET_POLLS:
+        interval *= 2 ** min(state['unchanged'] // QUIET_POLLS, 3)
+    if state['latency'] and state['latency'] > SLOW_LATENCY:
+        interval *= 2
+    # Never sleep past the start of business hours
+    return min(interval, MAX_OFF_PEAK_INTERVAL, hours.seconds_until_open(now))
+
+def due_sources(now=None):
+    """
+    Names of the sources whose next poll time has come. An open breaker whose
+    backoff has expired moves to half-open for one trial poll.
+    """
+    now = now or time.time()
+    due = []
+    for name in SOURCES:
+        state = _state(name)
+        if state['next_poll'] - POLL_SLACK <= now:
+            if state['breaker'] == 'open':
+                state['breaker'] = 'half_open'
+            due.append(name)
+    return due
+
+def _record_poll(name, started, result, duration, error=None):
+    """Updates polling and health state after a poll. result is None when it failed."""
+    state = _state(name)
+    state['recent'].append((result is not None, duration))
+    if result is not None:
+        previous = [(row['name'], row['men'], row['women']) for row in state['last_good']]
+        current = [(row['name'], row['men'], row['women']) for row in result]
+        state['unchanged'] = state['unchanged'] + 1 if previous == current else 0
+        state['failures'] = 0
+        state['breaker'] = 'closed'
+        state['last_good'] = [dict(row) for row in result]
+        state['last_good_at'] = started
+        if state['latency'] is None:
+            state['latency'] = duration
+        else:
+            state['latency'] += LATENCY_SMOOTHING * (duration - state['latency'])
+    else:
+        state['failures'] += 1
+        state['last_error'] = error
+        if state['breaker'] == 'half_open' or state['failures'] >= FAILURE_THRESHOLD:
+            if state['breaker'] != 'open':
+                print(f"Circuit open for {name} after {state['failures']} failures", file=sys.stderr)
+            state['breaker'] = 'open'
+    state['next_poll'] = started + next_interval(name, started)
+
+def _serve_rows(name, now):
+    """
+    Rows to publish for a source: its last good rows, marked stale with their age
+    while the source is failing, and dropped once older than LAST_GOOD_MAX_AGE.
+    """
+    state = _state(name)
+    if not state['last_good']:
+        return []
+    if not state['failures']:
+        return [dict(row) for row in state['last_good']]
+    age = now - state['last_good_at']
+    if age > LAST_GOOD_MAX_AGE:
+        return []
+    return [dict(row, stale=True, stale_age=int(age)) for row in state['last_good']]
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def get_health():
+    """Returns breaker state, schedule and rolling statistics of every source (for the API)."""
+    now = time.time()
+    health = {}
+    for name in SOURCES:
+        state = _state(name)
+        latencies = [duration for ok, duration in state['recent'] if ok]
+        health[name] = {
+            'breaker': state['breaker'],
+            'failures': state['failures'],
+            'last_error': state['last_error'],
+            'last_good_age': round(now - state['last_good_at'], 1) if state['last_good_at'] else None,
+            'next_poll_in': round(max(0, state['next_poll'] - now), 1),
+            'unchanged_polls': state['unchanged'],
+            'success_rate': round(sum(ok for ok, _ in state['recent']) / len(state['recent']), 3) if state['recent'] else None,
+            'latency_p50': round(_percentile(latencies, 0.5), 3) if latencies else None,
+            'latency_p95': round(_percentile(latencies, 0.95), 3) if latencies else None
+        }
+    return health
+
+def fetch_all(deadline=REFRESH_DEADLINE, force=False):
+    """
+    Fetches every due source concurrently under one overall deadline.
+    Sources that are not due yet (see next_interval) or whose breaker is open
+    are not contacted; their last good rows are reused, marked stale while failing.
+    Returns (data, report) where report maps source name to
+    {'status': 'ok'|'error'|'timeout'|'cached'|'stale', 'count': int, 'time': float}.
+    """
+    start = time.time()
+    due = list(SOURCES) if force else due_sources(start)
+    futures = {name: _executor.submit(_run_source, name) for name in due}
+    wait(futures.values(), timeout=deadline)
+
+    data = []
+    report = {}
+    for name in SOURCES:
+        future = futures.get(name)
+        status = 'cached'
+        duration = 0.0
+        if future is not None and not future.done():
+            print(f"Source {name} missed the {deadline}s deadline", file=sys.stderr)
+            _record_poll(name, start, None, deadline, "deadline exceeded")
+            status = 'timeout'
+            duration = time.time() - start
+        elif future is not None:
+            result, error, duration = future.result()
+            _record_poll(name, start, result, duration, error)
+            status = 'ok' if result is not None else 'error'
+
+        rows = _serve_rows(name, start)
+        if status == 'cached' and rows and rows[0].get('stale'):
+            status = 'stale'
+        data.extend(rows)
+        report[name] = {"status": status, "count": len(rows), "time": round(duration, 2)}
+        metrics.source_polls.inc(source=name, status=status)
+
+    return data, report
 
 def get_all_data():
+    data, _ = fetch_all()
+    return data
+
+def fetch_every_source(timeout=None):
+    """
+    Fetches and parses every source now, for diagnostics. Unlike fetch_all it
+    ignores the polling schedule, breakers and response cache and changes none of
+    them. Sources are fetched one at a time off the refresh's executor, and only
+    one diagnostic sweep runs at a time, so /api/debug cannot starve the refresh.
+    """
     data = []
-    # Add existing
-    data.extend(get_oriental_data())
-    data.extend(get_jis_data())
-    
-    # Add new sources
-    data.extend(get_xix_data())
-    data.extend(get_alfa_data())
-    data.extend(get_yatakoi_data())
-    
+    with _debug_lock:
+        for name, source in SOURCES.items():
+            try:
+                response = http_pool.get(source['url'], source['transport'], headers=source.get('headers'),
+                                         timeout=timeout or source['timeout'])
+                response.raise_for_status()
+                data.extend(parse_payload(name, response.content))
+            except Exception as e:
+                print(f"Error fetching {source['label']} data: {e}", file=sys.stderr)
     return data
 
 def find_store_with_max_women(data):
     if not data:
         return None
     
-    # Sort by women count descending
-    sorted_data = sorted(data, key=lambda x: x['women'], reverse=True)
-    return sorted_data[0]
+    # First store with the most women (no need to sort everything)
+    return max(data, key=lambda x: x['women'])
 
 def main():
     print("Starting Oriental Lounge Monitor (Interval: 5 minutes)")
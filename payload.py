@@ -0,0 +1,58 @@
+import json
+import gzip
+import hashlib
+
+# Pre-serialized API responses: built once per refresh, served as raw bytes.
+try:
+    import brotli
+except ImportError:
+    # Optional: without it only gzip and identity are offered
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _serialize(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def build(obj, version=None):
+    """
+    Serializes obj once and returns its encoded variants with an ETag:
+    {'etag': '...', 'identity': bytes, 'gzip': bytes, 'br': bytes or None}
+    The ETag is strong and hashes the body, unless version is given: then it is
+    weak and hashes only version (the part of obj that matters to a client), so
+    bodies differing only in e.g. a timestamp still revalidate with a 304.
+    """
+    body = _serialize(obj)
+    if version is None:
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+    else:
+        etag = 'W/"' + hashlib.sha1(_serialize(version)).hexdigest()[:20] + '"'
+    return {
+        'etag': etag,
+        'identity': body,
+        # mtime=0 keeps the gzip bytes identical for identical bodies
+        'gzip': gzip.compress(body, GZIP_LEVEL, mtime=0),
+        'br': brotli.compress(body, quality=BROTLI_QUALITY) if brotli else None
+    }
+
+
+def pick_encoding(payload, accept_encodings):
+    """Returns (encoding, bytes) for the best variant the client accepts."""
+    offered = ['br', 'gzip'] if payload['br'] is not None else ['gzip']
+    best = accept_encodings.best_match(offered + ['identity'], default='identity')
+    return best, payload[best]
+
+
+def _opaque(tag):
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(payload, if_none_match):
+    """True when the If-None-Match header lists the payload's ETag (or *), by weak comparison."""
+    if not if_none_match:
+        return False
+    tags = [_opaque(tag.strip()) for tag in if_none_match.split(',')]
+    return '*' in tags or _opaque(payload['etag']) in tags
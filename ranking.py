@@ -0,0 +1,74 @@
+import bisect
+
+# Ranking order: women descending, then men descending, then name for a stable tiebreak
+
+
+class RankingIndex:
+    """
+    Keeps the store ranking ordered as counts change, overall and per region.
+    Works on store IDs of snapshot.Snapshot polls: only stores whose counts changed
+    are moved (bisect remove + insert); nothing is re-sorted.
+    Not thread-safe: update() is called from one thread only (the leader's single-flight
+    refresh, or the follower loop).
+    """
+
+    def __init__(self):
+        # Sorted (-women, -men, name, store ID) keys, overall and per region
+        self._keys = []
+        self._region_keys = {}
+        # store ID -> (key, region) currently indexed
+        self._entries = {}
+        self._order = []
+
+    def _insert(self, key, region):
+        bisect.insort(self._keys, key)
+        bisect.insort(self._region_keys.setdefault(region, []), key)
+
+    def _remove(self, key, region):
+        for keys in (self._keys, self._region_keys.get(region, [])):
+            index = bisect.bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                del keys[index]
+
+    def update(self, snapshot):
+        """
+        Applies a new poll. Returns {store ID: rank change} for stores whose position
+        moved (positive = moved up). New stores are not included.
+        """
+        catalog = snapshot.catalog
+        previous_rank = {store_id: rank for rank, store_id in enumerate(self._order)}
+        seen = set()
+        for store_id in snapshot.ids():
+            seen.add(store_id)
+            key = (-snapshot.women[store_id], -snapshot.men[store_id], catalog.names[store_id], store_id)
+            region = catalog.regions[store_id]
+            old = self._entries.get(store_id)
+            if old == (key, region):
+                continue
+            if old is not None:
+                self._remove(*old)
+            self._entries[store_id] = (key, region)
+            self._insert(key, region)
+
+        for store_id in [store_id for store_id in self._entries if store_id not in seen]:
+            self._remove(*self._entries.pop(store_id))
+
+        self._order = [key[3] for key in self._keys]
+        moves = {}
+        for rank, store_id in enumerate(self._order):
+            before = previous_rank.get(store_id)
+            if before is not None and before != rank:
+                moves[store_id] = before - rank
+        return moves
+
+    def ranking(self):
+        """All store IDs in ranking order."""
+        return list(self._order)
+
+    def top(self, k=1, region=None):
+        """Top k store IDs (all of them for k=None) overall or within one region."""
+        keys = self._keys if region is None else self._region_keys.get(region, [])
+        return [key[3] for key in keys[:k]]
+
+    def top_store(self):
+        return self._keys[0][3] if self._keys else None
@@ -0,0 +1,67 @@
+import re
+from functools import lru_cache
+
+# Region Definitions
+REGIONS = {
+    'Hokkaido': ['Sapporo', '札幌', 'SAPPORO'],
+    'Tohoku': ['Sendai', '仙台'],
+    'Kanto': ['Shibuya', 'Ebisu', 'Shinjuku', 'Ueno', 'Kashiwa', 'Machida', 'Yokohama', 'Omiya', 'Utsunomiya', 'Takasaki', '渋谷', '恵比寿', '新宿', '上野', '柏', '町田', '横浜', '大宮', '宇都宮', '高崎', 'OMIYA', 'SHINJUKU', 'NISHISHINJUKU'],
+    'Chubu': ['Nagoya', 'Shizuoka', 'Hamamatsu', 'Kanazawa', '名古屋', '静岡', '浜松', '金沢'],
+    'Kinki': ['Osaka', 'Umeda', 'Tenma', 'Shinsaibashi', 'Namba', 'Kyoto', 'Kobe', 'Chayamachi', '大阪', '梅田', '天満', '心斎橋', '難波', '京都', '神戸', '茶屋町', 'UMEDA', 'NAMBA', 'CHAYAMACHI'],
+    'Chugoku': ['Okayama', 'Hiroshima', '岡山', '広島', 'OKAYAMA', 'HIROSHIMA'],
+    'Shikoku': ['Matsuyama', '松山', 'MATSUYAMA'],
+    'Kyushu': ['Fukuoka', 'Kokura', 'Nagasaki', 'Oita', 'Kumamoto', 'Miyazaki', 'Kagoshima', 'Okinawa', '福岡', '小倉', '長崎', '大分', '熊本', '宮崎', '鹿児島', '沖縄', 'FUKUOKA', 'KUMAMOTO'],
+    'Korea': ['Seoul', 'Gangnam', 'Hongdae', 'ソウル', 'カンナム', 'ホンデ']
+}
+
+# Explicit overrides, checked before the keywords:
+# exact store name -> region
+STORE_REGIONS = {}
+# source -> region, for single-location chains
+SOURCE_REGIONS = {
+    'xix': 'Chugoku',
+    'alfa': 'Chugoku',
+    'yatakoi': 'Kinki'
+}
+
+# Distinct store names are few, so the cache never evicts in practice
+CACHE_SIZE = 4096
+
+_pattern = None
+_keyword_rank = {}
+_region_order = []
+
+
+def compile_regions():
+    """
+    Compiles REGIONS into one regex. Call again after editing REGIONS.
+    The pattern is a lookahead so every position is tried once, and keywords are
+    ordered by region so the first region in REGIONS wins, like the old nested loop.
+    """
+    global _pattern, _keyword_rank, _region_order
+    _region_order = list(REGIONS)
+    _keyword_rank = {}
+    for rank, keywords in enumerate(REGIONS.values()):
+        for keyword in keywords:
+            _keyword_rank.setdefault(keyword, rank)
+    keywords = sorted(_keyword_rank, key=lambda k: (_keyword_rank[k], -len(k)))
+    _pattern = re.compile('(?=(' + '|'.join(map(re.escape, keywords)) + '))')
+    _classify.cache_clear()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _classify(store_name):
+    ranks = [_keyword_rank[keyword] for keyword in _pattern.findall(store_name)]
+    return _region_order[min(ranks)] if ranks else 'Other'
+
+
+def detect_region(store_name, source=None):
+    """Detects the region based on the store name (or an explicit override)."""
+    if store_name in STORE_REGIONS:
+        return STORE_REGIONS[store_name]
+    if source in SOURCE_REGIONS:
+        return SOURCE_REGIONS[source]
+    return _classify(store_name)
+
+
+compile_regions()
@@ -0,0 +1,224 @@
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+# Snapshot sharing between gunicorn workers.
+# One process per host holds an exclusive flock on LOCK_FILE and is the leader:
+# it runs the scheduler (scraping, history, Sheets export) and publishes every
+# snapshot to SNAPSHOT_FILE, replaced atomically. The other workers only serve
+# requests: they poll the file's mtime, load each new snapshot and broadcast its
+# diff to their own stream clients. The kernel drops the lock when the leader
+# exits, and the next worker to retry takes over.
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): every process scrapes for itself, as with one worker
+    fcntl = None
+
+# /dev/shm keeps the snapshot in shared memory on Linux
+SHARED_DIR = os.environ.get('SHARED_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+LOCK_FILE = os.path.join(SHARED_DIR, 'lounge-monitor.lock')
+SNAPSHOT_FILE = os.path.join(SHARED_DIR, 'lounge-monitor.snapshot')
+# On-disk copy that survives a restart (/dev/shm does not), loaded at boot so the
+# first request after a cold start is answered from the last snapshot
+PERSIST_FILE = os.environ.get('SNAPSHOT_PERSIST', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot.bin'))
+# Leader-only state served by every worker: source health and cache counters
+STATE_FILE = os.path.join(SHARED_DIR, 'lounge-monitor.state.json')
+# Per-worker metric dumps, summed by /metrics: lounge-monitor.metrics.<pid>.json
+METRICS_PREFIX = 'lounge-monitor.metrics.'
+# Seconds between followers' checks for a new snapshot (and for a vacant leadership)
+FOLLOW_INTERVAL = 1
+# Seconds between each worker's metric (and the leader's state) publications
+PUBLISH_INTERVAL = 5
+
+# File layout: MAGIC, 4-byte header length, JSON header, then the payload variants
+# back to back in the order and sizes listed in the header
+MAGIC = b'LMS1'
+VARIANTS = ('identity', 'gzip', 'br')
+
+_lock_fd = None
+_leader = fcntl is None
+
+
+def is_leader():
+    return _leader
+
+
+def try_lead():
+    """Takes the leader lock if it is free. Returns True if this process is the leader."""
+    global _lock_fd, _leader
+    if _leader:
+        return True
+    fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    # Kept open for the life of the process; closing it would release the lock
+    _lock_fd = fd
+    _leader = True
+    return True
+
+
+def publish(meta, payload):
+    """
+    Writes a snapshot for the other workers. meta is a JSON-serializable dict
+    (timestamps, diff); payload is a payload.build() result.
+    Also written to PERSIST_FILE for the next boot.
+    """
+    sizes = {name: len(payload[name]) for name in VARIANTS if payload[name] is not None}
+    header = json.dumps(dict(meta, etag=payload['etag'], sizes=sizes), ensure_ascii=False).encode('utf-8')
+    data = [MAGIC, struct.pack('>I', len(header)), header] + [payload[name] for name in VARIANTS if name in sizes]
+    for path in (SNAPSHOT_FILE, PERSIST_FILE):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.writelines(data)
+        os.replace(tmp, path)
+
+
+def load(path=SNAPSHOT_FILE):
+    """Reads a snapshot file. Returns (meta, payload), or (None, None) if there is none."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None, None
+    if data[:4] != MAGIC:
+        return None, None
+    header_size = struct.unpack('>I', data[4:8])[0]
+    meta = json.loads(data[8:8 + header_size])
+    payload = {'etag': meta.pop('etag'), 'br': None}
+    offset = 8 + header_size
+    for name in VARIANTS:
+        size = meta['sizes'].get(name)
+        if size is not None:
+            payload[name] = data[offset:offset + size]
+            offset += size
+    del meta['sizes']
+    return meta, payload
+
+
+def load_latest():
+    """The snapshot published by a running leader, else the one persisted by the last run."""
+    meta, payload = load()
+    if meta is None:
+        meta, payload = load(PERSIST_FILE)
+    return meta, payload
+
+
+def _write_json(path, obj):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def publish_state(state):
+    """Leader: writes its source health / cache state for the followers to serve."""
+    _write_json(STATE_FILE, state)
+
+
+def load_state():
+    """The leader's last published state, or {} before it has published any."""
+    try:
+        with open(STATE_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def publish_metrics(dump):
+    _write_json(os.path.join(SHARED_DIR, f"{METRICS_PREFIX}{os.getpid()}.json"), dump)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def load_peer_metrics():
+    """Metric dumps of the other live workers. Files left by exited workers are removed."""
+    dumps = []
+    for filename in os.listdir(SHARED_DIR):
+        if not (filename.startswith(METRICS_PREFIX) and filename.endswith('.json')):
+            continue
+        try:
+            pid = int(filename[len(METRICS_PREFIX):-len('.json')])
+        except ValueError:
+            continue
+        path = os.path.join(SHARED_DIR, filename)
+        if pid == os.getpid():
+            continue
+        if not _alive(pid):
+            # Its counts go with it; Prometheus treats the drop as a counter reset
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path, encoding='utf-8') as f:
+                dumps.append(json.load(f))
+        except (FileNotFoundError, ValueError):
+            continue
+    return dumps
+
+
+def start_publishing(publish):
+    """Calls publish() every PUBLISH_INTERVAL seconds on a background thread."""
+    def run():
+        while True:
+            try:
+                publish()
+            except Exception as e:
+                print(f"Could not publish worker state: {e}", file=sys.stderr)
+            time.sleep(PUBLISH_INTERVAL)
+
+    threading.Thread(target=run, name="state-publisher", daemon=True).start()
+
+
+def _snapshot_version():
+    try:
+        stat = os.stat(SNAPSHOT_FILE)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+
+def follow(on_snapshot, on_elected):
+    """
+    Starts the follower loop of a worker that is not the leader. on_snapshot(meta, payload)
+    is called for each new snapshot; on_elected() once if this worker becomes the leader.
+    """
+    def run():
+        version = None
+        while True:
+            if try_lead():
+                print(f"Worker {os.getpid()} took over as leader.")
+                on_elected()
+                return
+            current = _snapshot_version()
+            if current is not None and current != version:
+                try:
+                    meta, payload = load()
+                    if meta is not None:
+                        on_snapshot(meta, payload)
+                    version = current
+                except Exception as e:
+                    # Leave version unchanged so the next tick retries
+                    print(f"Could not load shared snapshot: {e}", file=sys.stderr)
+            time.sleep(FOLLOW_INTERVAL)
+
+    threading.Thread(target=run, name="snapshot-follower", daemon=True).start()
@@ -0,0 +1,127 @@
+import sys
+from array import array
+from regions import detect_region
+
+# Compact poll snapshots.
+# Every store gets a stable integer ID from the Catalog the first time it is
+# seen; its name, source and region are stored there once (interned). A Snapshot
+# is then only two count columns indexed by store ID, so keeping one costs a few
+# bytes per store instead of a dict per store, and diffing two polls is a
+# column comparison.
+
+# Count stored for a store missing from a poll
+ABSENT = -1
+
+
+class Catalog:
+    """Stable store IDs with the per-store strings that do not change between polls."""
+    __slots__ = ('ids', 'names', 'sources', 'regions')
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.sources = []
+        self.regions = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name, source, region=None):
+        """Returns the store's ID, adding it (and detecting its region) on first sight."""
+        store_id = self.ids.get(name)
+        if store_id is None:
+            store_id = len(self.names)
+            name = sys.intern(name)
+            self.ids[name] = store_id
+            self.names.append(name)
+            self.sources.append(sys.intern(source))
+            self.regions.append(sys.intern(region or detect_region(name, source)))
+        return store_id
+
+
+class Snapshot:
+    """
+    One poll: men/women counts per store ID (ABSENT when the store was not in it)
+    and the age of stores served from stale data.
+    """
+    __slots__ = ('catalog', 'ts', 'men', 'women', 'stale')
+
+    def __init__(self, catalog, ts):
+        self.catalog = catalog
+        self.ts = ts
+        self.men = array('i')
+        self.women = array('i')
+        # Sparse {store ID: stale age in seconds}; empty while every source is healthy
+        self.stale = {}
+
+    @classmethod
+    def from_rows(cls, catalog, rows, ts):
+        """Builds a snapshot from store rows ({'name', 'men', 'women', 'source', ...})."""
+        ids = [catalog.intern(row['name'], row['source'], row.get('region')) for row in rows]
+        snapshot = cls(catalog, ts)
+        snapshot.men = array('i', [ABSENT]) * len(catalog)
+        snapshot.women = array('i', [ABSENT]) * len(catalog)
+        for store_id, row in zip(ids, rows):
+            snapshot.men[store_id] = row['men']
+            snapshot.women[store_id] = row['women']
+            if row.get('stale'):
+                snapshot.stale[store_id] = row.get('stale_age')
+        return snapshot
+
+    def __len__(self):
+        return len(self.men) - self.men.count(ABSENT)
+
+    def __contains__(self, store_id):
+        return store_id < len(self.men) and self.men[store_id] != ABSENT
+
+    def ids(self):
+        return [store_id for store_id, men in enumerate(self.men) if men != ABSENT]
+
+    def row(self, store_id):
+        """The store as the dict served by the API."""
+        catalog = self.catalog
+        row = {
+            'name': catalog.names[store_id],
+            'men': self.men[store_id],
+            'women': self.women[store_id],
+            'source': catalog.sources[store_id],
+            'region': catalog.regions[store_id]
+        }
+        if store_id in self.stale:
+            row['stale'] = True
+            row['stale_age'] = self.stale[store_id]
+        return row
+
+
+def _column(snapshot, name, size):
+    column = getattr(snapshot, name) if snapshot is not None else array('i')
+    if len(column) < size:
+        # The catalog grew since this snapshot was taken
+        column = column + array('i', [ABSENT]) * (size - len(column))
+    return column
+
+
+def diff(previous, current):
+    """
+    Compares two snapshots of the same catalog (previous may be None).
+    Returns (changed, removed): IDs of stores that are new or whose counts or
+    staleness changed, and IDs of stores no longer present.
+    """
+    size = len(current.men)
+    before_men = _column(previous, 'men', size)
+    before_women = _column(previous, 'women', size)
+    before_stale = previous.stale if previous is not None else {}
+    if before_men == current.men and before_women == current.women and before_stale.keys() == current.stale.keys():
+        return [], []
+
+    changed = []
+    removed = []
+    for store_id in range(size):
+        men = current.men[store_id]
+        if men == ABSENT:
+            if before_men[store_id] != ABSENT:
+                removed.append(store_id)
+        elif (men != before_men[store_id] or current.women[store_id] != before_women[store_id]
+                or (store_id in current.stale) != (store_id in before_stale)):
+            changed.append(store_id)
+    return changed, removed
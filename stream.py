@@ -0,0 +1,89 @@
+import json
+import os
+import queue
+import threading
+
+# Server-Sent Events fan-out for live ranking updates.
+# Every event is formatted once in publish() and the same bytes are queued to
+# each client, so a broadcast costs one serialization regardless of audience.
+
+# gunicorn's --worker-connections (see Procfile). Each stream holds one of the
+# worker's connections for as long as it is open.
+WORKER_CONNECTIONS = int(os.environ.get('WORKER_CONNECTIONS', 5000))
+# Upper bound on concurrent stream clients per worker, leaving a fifth of its
+# connections for page loads and API requests; extra clients fall back to polling
+MAX_CLIENTS = WORKER_CONNECTIONS * 4 // 5
+# Events buffered per client. A client that falls this far behind is dropped
+# (it reconnects and receives a fresh snapshot).
+CLIENT_QUEUE_SIZE = 16
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 25
+
+_clients = set()
+_clients_lock = threading.Lock()
+
+# Sentinel queued to a client that has been dropped
+_CLOSE = object()
+
+
+def format_event(event, data):
+    """Formats one SSE message. data is a JSON-serializable object or a JSON string."""
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"event: {event}\ndata: {data}\n\n".encode('utf-8')
+
+
+def subscribe():
+    """Registers a client. Returns its queue, or None when MAX_CLIENTS is reached."""
+    client = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+    with _clients_lock:
+        if len(_clients) >= MAX_CLIENTS:
+            return None
+        _clients.add(client)
+    return client
+
+
+def unsubscribe(client):
+    with _clients_lock:
+        _clients.discard(client)
+
+
+def client_count():
+    return len(_clients)
+
+
+def publish(event, data):
+    """Broadcasts an event to every connected client."""
+    message = format_event(event, data)
+    with _clients_lock:
+        clients = list(_clients)
+    for client in clients:
+        try:
+            client.put_nowait(message)
+        except queue.Full:
+            # Slow consumer: drop it rather than buffer without bound
+            unsubscribe(client)
+            try:
+                client.get_nowait()
+                client.put_nowait(_CLOSE)
+            except (queue.Empty, queue.Full):
+                pass
+
+
+def events(client, initial=None):
+    """Generator of SSE bytes for one client; unsubscribes when the client goes away."""
+    try:
+        if initial:
+            yield initial
+        while True:
+            try:
+                message = client.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield b": ping\n\n"
+                continue
+            if message is _CLOSE:
+                return
+            yield message
+    finally:
+        unsubscribe(client)
+